@@ -32,13 +32,22 @@ public function handle(SpotifyDownloadJobEvent $event): void
         if ($availableTrack) {
             event(new SpotifyDownloaderEvent('download-success', $event->socketId, ['path' => $availableTrack->url]));
         } else {
-            event(new SpotifyDownloaderEvent('download-sleep', $event->socketId, []));
-            sleep(10);
+            $spotifyService = new SpotifyTrackDownloaderService();
+
+            // The long-lived worker paces downloads itself with a token bucket
+            if (!$spotifyService->usesDaemon()) {
+                event(new SpotifyDownloaderEvent('download-sleep', $event->socketId, []));
+                sleep(10);
+            }
             
             event(new SpotifyDownloaderEvent('begin-download', $event->socketId, []));
             
-            $spotifyService = new SpotifyTrackDownloaderService();
             $output = $spotifyService->processDownload($event->trackId, $event->socketId);
+
+            // A --lazy worker only stores the source, the mp3 is converted on request
+            if (isset($output->status) && $output->status == 'source-stored') {
+                $output = $spotifyService->getTrack($event->trackId);
+            }
     
             if (isset($output->status) && $output->status == 'downloading-error') {
                 event(new SpotifyDownloaderEvent('download-error', $event->socketId, ['message' => $output->message]));
@@ -0,0 +1,70 @@
+"""Microbenchmark of RespotUtils.parse_url against the previous per-type regex scan.
+
+Run from app/Python/spotify:
+    python benchmarks/bench_parse_url.py [--lines 10000] [--repeat 5]
+"""
+from pathlib import Path
+import argparse
+import random
+import re
+import string
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules.respot import RespotUtils
+
+
+def legacy_parse_url(search_input) -> dict:
+    """The previous implementation: re.sub plus twelve uncompiled searches"""
+    search_input = re.sub(r"intl-[^/]+/", "", search_input)
+    parsed = {}
+    for kind in RespotUtils.URL_TYPES:
+        uri = re.search(rf"^spotify:{kind}:(?P<ID>[0-9a-zA-Z]{{22}})$", search_input)
+        url = re.search(
+            rf"^(https?://)?open\.spotify\.com/{kind}/(?P<ID>[0-9a-zA-Z]{{22}})(\?si=.+?)?$",
+            search_input,
+        )
+        match = uri or url
+        parsed[kind] = match.group("ID") if match else None
+    return parsed
+
+
+def generate_lines(count, seed=1) -> list:
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits
+    templates = [
+        "spotify:{kind}:{id}",
+        "https://open.spotify.com/{kind}/{id}",
+        "https://open.spotify.com/{kind}/{id}?si=abcdef0123456789",
+        "https://open.spotify.com/intl-de/{kind}/{id}?si=abcdef&context=spotify%3Aplaylist",
+        "not a spotify link {id}",
+    ]
+    lines = []
+    for _ in range(count):
+        track_id = "".join(rng.choice(alphabet) for _ in range(22))
+        kind = rng.choice(RespotUtils.URL_TYPES)
+        lines.append(rng.choice(templates).format(kind=kind, id=track_id))
+    return lines
+
+
+def measure(name, func, lines, repeat) -> None:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(lines)
+        best = min(best, time.perf_counter() - started)
+    print(f"{name:<28} {best * 1000:9.2f} ms  {len(lines) / best:12,.0f} urls/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    lines = generate_lines(args.lines)
+    measure("legacy parse_url", lambda ls: [legacy_parse_url(l) for l in ls], lines, args.repeat)
+    measure("parse_url", lambda ls: [RespotUtils.parse_url(l) for l in ls], lines, args.repeat)
+    measure("parse_urls (batch)", RespotUtils.parse_urls, lines, args.repeat)
@@ -0,0 +1,395 @@
+"""Offline benchmark suite, runs without a Spotify account or network access.
+
+librespot and the Web API are replaced by benchmarks/fakes.py, everything
+else (Respot, caches, archive, ffmpeg, taggers) is the production code.
+Every benchmark runs in its own process, so peak RSS is per benchmark.
+
+Run from app/Python/spotify:
+    python benchmarks/bench_suite.py [--only download_track get_track_info]
+    python benchmarks/bench_suite.py --json results.json
+    python benchmarks/bench_suite.py --baseline results.json --threshold 0.15
+"""
+from pathlib import Path
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fakes
+
+
+BENCHMARKS = {}
+
+
+def benchmark(iterations):
+    """Registers a benchmark running `iterations` operations by default"""
+
+    def register(func):
+        BENCHMARKS[func.__name__.replace("bench_", "")] = (func, iterations)
+        return func
+
+    return register
+
+
+def make_spotify(workdir: Path, args, stream_audio=False):
+    """Builds a Spotify instance on the fakes, with every folder under workdir.
+
+    Args:
+        stream_audio (bool): Serve real Ogg audio, rendered with ffmpeg. Without
+            it tracks stream empty, enough for metadata only benchmarks.
+    """
+    import spotify_downloader
+    from modules.respot import RespotRequest
+
+    spotify_downloader.CONFIG_DIR = str(workdir / "configs")
+    spotify_downloader.TEMP_DIR = str(workdir / "temp")
+    spotify_downloader.DOWNLOAD_DIR = str(workdir / "downloads")
+
+    # Spotify parses the command line of the process
+    argv, sys.argv = sys.argv, sys.argv[:1]
+    try:
+        spotify = spotify_downloader.Spotify()
+    finally:
+        sys.argv = argv
+
+    ogg_bytes = b""
+    if stream_audio:
+        ogg_bytes = fakes.make_audio(workdir / "source.ogg", "ogg", args.audio_seconds)
+    bandwidth = args.bandwidth * 1024 * 1024 if args.bandwidth else None
+
+    auth = spotify.respot.auth
+    auth.session = fakes.FakeSession(ogg_bytes, bandwidth)
+    auth.refresh_token()
+    check_token_expiry(auth)
+    auth._check_premium()
+
+    api = fakes.FakeWebApi(latency=args.api_latency / 1000)
+    spotify.respot.request = RespotRequest(auth, spotify.metadata_cache)
+    api.mount(spotify.respot.request.session)
+    api.mount(spotify.artwork_cache.session)
+
+    # Measure the work, not the anti-ban pacing
+    spotify.respot.limiter = None
+    spotify.respot.antiban_wait_time = 0
+    return spotify
+
+
+def check_token_expiry(auth) -> None:
+    """Fails when tokens would not be renewed ahead of their expiry.
+
+    The fake provider hands out librespot's own StoredToken, valid for an
+    hour, so the expiry must land within the next hour.
+    """
+    remaining = auth.token_expires_at - time.time()
+    if not 0 < remaining <= 3600:
+        raise RuntimeError(f"Token expiry is {remaining:.0f}s away, expected within an hour")
+
+
+@benchmark(iterations=20)
+def bench_download_track(workdir, args, count):
+    """Metadata, streaming, conversion to mp3, archive and tags of one track"""
+    spotify = make_spotify(workdir, args, stream_audio=True)
+    latencies = []
+    for track_id in fakes.random_ids(count):
+        started = time.perf_counter()
+        result = spotify.download_track(track_id)
+        latencies.append(time.perf_counter() - started)
+        if result["status"] != "download-success":
+            raise RuntimeError(f"download_track failed: {result}")
+    return latencies
+
+
+@benchmark(iterations=200)
+def bench_get_track_info(workdir, args, count):
+    """Uncached metadata lookups through the pooled session"""
+    spotify = make_spotify(workdir, args)
+    latencies = []
+    for track_id in fakes.random_ids(count):
+        started = time.perf_counter()
+        spotify.respot.request.get_track_info(track_id)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+@benchmark(iterations=10000)
+def bench_archive_add(workdir, args, count):
+    from modules.utils import Archive
+
+    archive = Archive(workdir / "archive.json")
+    latencies = []
+    for index, track_id in enumerate(fakes.random_ids(count)):
+        started = time.perf_counter()
+        archive.add(
+            track_id,
+            artist="Benchmark Artist",
+            track_name=f"Track {index}",
+            fullpath=str(workdir / f"{track_id}.mp3"),
+        )
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+@benchmark(iterations=10000)
+def bench_parse_url(workdir, args, count):
+    from bench_parse_url import generate_lines
+    from modules.respot import RespotUtils
+
+    latencies = []
+    for line in generate_lines(count):
+        started = time.perf_counter()
+        RespotUtils.parse_url(line)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+@benchmark(iterations=200)
+def bench_tagging(workdir, args, count):
+    """ID3 tags plus artwork on a fresh mp3, artwork served from the cache"""
+    from modules.cache import ArtworkCache
+    from modules.tagger import AudioTagger
+
+    artwork_cache = ArtworkCache(workdir / "artwork")
+    fakes.FakeWebApi().mount(artwork_cache.session)
+    tagger = AudioTagger(artwork_cache)
+
+    source = workdir / "source.mp3"
+    fakes.make_audio(source, "mp3", args.audio_seconds)
+
+    latencies = []
+    for index in range(count):
+        path = workdir / f"tagged-{index}.mp3"
+        shutil.copyfile(source, path)
+        started = time.perf_counter()
+        tagger.set_audio_tags(
+            path,
+            artists="Benchmark Artist",
+            name=f"Track {index}",
+            album_name="Benchmark Album",
+            release_year="2023",
+            disc_number=1,
+            track_number=index + 1,
+            track_id_str="0" * 22,
+            image_url="https://i.scdn.co/image/album",
+        )
+        latencies.append(time.perf_counter() - started)
+        path.unlink()
+    return latencies
+
+
+@benchmark(iterations=10)
+def bench_conversion(workdir, args, count):
+    """Ogg Vorbis to 320k mp3 through ffmpeg"""
+    from librespot.audio.decoders import AudioQuality
+    from modules.respot import RespotTrackHandler
+
+    source = workdir / "source.ogg"
+    fakes.make_audio(source, "ogg", args.audio_seconds)
+    handler = RespotTrackHandler(None, "mp3", 0, AudioQuality.VERY_HIGH)
+
+    latencies = []
+    for index in range(count):
+        output_path = workdir / f"converted-{index}.mp3"
+        started = time.perf_counter()
+        handler.convert_audio_file(source, output_path)
+        latencies.append(time.perf_counter() - started)
+        output_path.unlink()
+    return latencies
+
+
+TAG_FIELDS = {
+    "artists": "Benchmark Artist",
+    "name": "Benchmark Track",
+    "album_name": "Benchmark Album",
+    "release_year": "2023",
+    "disc_number": 1,
+    "track_number": 1,
+    "track_id_str": "0" * 22,
+    "image_url": "https://i.scdn.co/image/album",
+}
+
+
+def make_tagger(workdir):
+    from modules.cache import ArtworkCache
+    from modules.tagger import AudioTagger
+
+    artwork_cache = ArtworkCache(workdir / "artwork")
+    fakes.FakeWebApi().mount(artwork_cache.session)
+    return AudioTagger(artwork_cache)
+
+
+@benchmark(iterations=200)
+def bench_artwork_downscale(workdir, args, count):
+    """Uncached resize and recompression of a 640px cover"""
+    from modules.cache import ArtworkCache
+
+    artwork_cache = ArtworkCache()
+    api = fakes.FakeWebApi()
+    api.mount(artwork_cache.session)
+
+    latencies = []
+    for index in range(count):
+        url = f"https://i.scdn.co/image/{index}"
+        artwork_cache.get(url)
+        started = time.perf_counter()
+        artwork_cache.get(url, 500)
+        latencies.append(time.perf_counter() - started)
+    artwork_cache.shutdown()
+    return latencies
+
+
+@benchmark(iterations=10)
+def bench_convert_then_tag(workdir, args, count):
+    """Ogg to mp3, then ID3 tags inserted in front of the finished file"""
+    from modules.transcoder import transcode
+
+    source = workdir / "source.ogg"
+    fakes.make_audio(source, "ogg", args.audio_seconds)
+    tagger = make_tagger(workdir)
+
+    latencies = []
+    for index in range(count):
+        output_path = workdir / f"converted-{index}.mp3"
+        started = time.perf_counter()
+        transcode(source, output_path, "mp3", "320k")
+        tagger.set_audio_tags(output_path, **TAG_FIELDS)
+        latencies.append(time.perf_counter() - started)
+        output_path.unlink()
+    return latencies
+
+
+@benchmark(iterations=10)
+def bench_convert_with_tags(workdir, args, count):
+    """Ogg to mp3 streamed behind a prebuilt ID3 block, no second write"""
+    from modules.transcoder import transcode
+
+    source = workdir / "source.ogg"
+    fakes.make_audio(source, "ogg", args.audio_seconds)
+    tagger = make_tagger(workdir)
+
+    latencies = []
+    for index in range(count):
+        output_path = workdir / f"converted-{index}.mp3"
+        started = time.perf_counter()
+        header = tagger.build_mp3_tags(**TAG_FIELDS)
+        transcode(source, output_path, "mp3", "320k", header)
+        latencies.append(time.perf_counter() - started)
+        output_path.unlink()
+    return latencies
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values, fraction) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+
+def run_child(name, args) -> dict:
+    func, iterations = BENCHMARKS[name]
+    count = args.iterations or iterations
+    with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as workdir:
+        started = time.perf_counter()
+        latencies = func(Path(workdir), args, count)
+        elapsed = time.perf_counter() - started
+
+    return {
+        "name": name,
+        "operations": len(latencies),
+        "throughput": len(latencies) / sum(latencies),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "wall_seconds": elapsed,
+        "peak_rss_mb": (peak_rss_bytes() or 0) / (1024 * 1024) or None,
+    }
+
+
+def run_isolated(name, args) -> dict:
+    command = [sys.executable, __file__, "--child", name]
+    command += ["--bandwidth", str(args.bandwidth), "--api-latency", str(args.api_latency)]
+    command += ["--audio-seconds", str(args.audio_seconds)]
+    if args.iterations:
+        command += ["--iterations", str(args.iterations)]
+
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0:
+        return {"name": name, "error": process.stderr.strip().splitlines()[-1:]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, threshold) -> list:
+    """Returns the names whose throughput dropped more than threshold"""
+    previous = {result["name"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result["name"])
+        if not before or "throughput" not in result or "throughput" not in before:
+            continue
+        change = result["throughput"] / before["throughput"] - 1
+        result["change"] = change
+        if change < -threshold:
+            regressions.append(result["name"])
+    return regressions
+
+
+def print_table(results) -> None:
+    print(f"{'benchmark':<18} {'ops':>7} {'ops/s':>12} {'p50 ms':>9} {'p99 ms':>9} {'rss MB':>8} {'change':>8}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['name']:<18} failed: {' '.join(result['error'])}")
+            continue
+        rss = f"{result['peak_rss_mb']:.1f}" if result["peak_rss_mb"] else "n/a"
+        change = f"{result['change']:+.1%}" if "change" in result else ""
+        print(
+            f"{result['name']:<18} {result['operations']:>7} {result['throughput']:>12,.1f} "
+            f"{result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} {rss:>8} {change:>8}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="Benchmarks to run")
+    parser.add_argument("--iterations", type=int, help="Operations per benchmark, overrides the defaults")
+    parser.add_argument("--bandwidth", type=float, default=8, help="Fake stream speed in MB/s, 0 for unthrottled")
+    parser.add_argument("--api-latency", type=float, default=20, help="Fake Web API latency in ms")
+    parser.add_argument("--audio-seconds", type=int, default=30, help="Length of the canned audio")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed throughput drop")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args)))
+        sys.exit(0)
+
+    results = [run_isolated(name, args) for name in args.only or BENCHMARKS]
+
+    regressions = []
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.threshold)
+
+    print_table(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+    if regressions:
+        print(f"Throughput regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+    sys.exit(1 if regressions or any("error" in result for result in results) else 0)
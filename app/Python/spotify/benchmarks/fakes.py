@@ -0,0 +1,227 @@
+"""Offline stand-ins for librespot and the Spotify Web API, used by the benchmarks.
+
+FakeSession replaces a logged in librespot Session: its content feeder
+serves canned Ogg bytes at a configurable bandwidth. FakeWebApi is a
+requests transport adapter answering api.spotify.com and the image host
+in-process, with a configurable latency per request.
+"""
+from urllib.parse import parse_qs, urlparse
+import io
+import json
+import random
+import shutil
+import string
+import subprocess
+import time
+
+from librespot.core import TokenProvider
+from PIL import Image
+import requests
+from requests.adapters import BaseAdapter
+
+
+BASE62 = string.digits + string.ascii_letters
+# librespot skips this many bytes of Spotify header before the Ogg data
+HEADER_SIZE = 0xA7
+
+
+def random_ids(count, seed=1) -> list:
+    rng = random.Random(seed)
+    return ["".join(rng.choice(BASE62) for _ in range(22)) for _ in range(count)]
+
+
+def make_jpeg(size=640) -> bytes:
+    """A noisy size x size JPEG, about as large as real album art"""
+    image = Image.effect_noise((size, size), 64).convert("RGB")
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=90)
+    return output.getvalue()
+
+
+def fake_track(track_id) -> dict:
+    """A Web API track object with every field RespotRequest reads"""
+    return {
+        "id": track_id,
+        "name": f"Track {track_id[:6]}",
+        "disc_number": 1,
+        "track_number": 1 + sum(map(ord, track_id)) % 20,
+        "is_playable": True,
+        "artists": [{"id": "0" * 22, "name": "Benchmark Artist"}],
+        "album": {
+            "name": "Benchmark Album",
+            "release_date": "2023-01-01",
+            "artists": [{"name": "Benchmark Artist"}],
+            "images": [
+                {"height": 640, "width": 640, "url": f"https://i.scdn.co/image/{track_id}"},
+                {"height": 64, "width": 64, "url": f"https://i.scdn.co/image/{track_id}-small"},
+            ],
+        },
+    }
+
+
+class FakeWebApi(BaseAdapter):
+    """Answers the Web API endpoints used by RespotRequest without a network"""
+
+    def __init__(self, latency=0.0, album_size=12):
+        """
+        Args:
+            latency (float): Seconds every request takes, like a round trip to Spotify.
+            album_size (int): Number of tracks in every album.
+        """
+        super().__init__()
+        self.latency = latency
+        self.album_size = album_size
+        self.image = make_jpeg()
+        self.requests = 0
+
+    def mount(self, session) -> None:
+        session.mount("https://api.spotify.com/", self)
+        session.mount("https://i.scdn.co/", self)
+
+    def send(self, request, **kwargs):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        url = urlparse(request.url)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+
+        if url.netloc == "i.scdn.co":
+            return self._response(request, 200, self.image, "image/jpeg")
+
+        if parts[:2] == ["v1", "tracks"] and len(parts) == 2:
+            ids = query.get("ids", [""])[0].split(",")
+            body = {"tracks": [fake_track(track_id) for track_id in ids]}
+        elif parts[:2] == ["v1", "tracks"]:
+            body = fake_track(parts[2])
+        elif parts[:2] == ["v1", "albums"] and parts[3:] == ["tracks"]:
+            offset = int(query.get("offset", ["0"])[0])
+            limit = int(query.get("limit", ["50"])[0])
+            ids = random_ids(self.album_size, seed=parts[2])[offset : offset + limit]
+            body = {
+                "items": [fake_track(track_id) for track_id in ids],
+                "total": self.album_size,
+            }
+        elif parts[:2] == ["v1", "albums"]:
+            body = {
+                "name": "Benchmark Album",
+                "artists": [{"name": "Benchmark Artist"}],
+                "total_tracks": self.album_size,
+                "release_date": "2023-01-01",
+                "images": [{"height": 640, "width": 640, "url": "https://i.scdn.co/image/album"}],
+            }
+        else:
+            return self._response(request, 404, b'{"error": "not found"}')
+
+        return self._response(request, 200, json.dumps(body).encode("utf-8"))
+
+    @staticmethod
+    def _response(request, status_code, content, content_type="application/json"):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = content
+        response.headers["Content-Type"] = content_type
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+class FakeInputStream:
+    """Mimics librespot's AbsChunkedInputStream, throttled to a bandwidth"""
+
+    def __init__(self, data, bandwidth=None):
+        self.data = data
+        self.bandwidth = bandwidth
+        self.position = HEADER_SIZE
+
+    def pos(self) -> int:
+        return self.position
+
+    def seek(self, where) -> None:
+        self.position = where
+
+    def read(self, size) -> bytes:
+        data = self.data[self.position : self.position + size]
+        self.position += len(data)
+        if self.bandwidth and data:
+            time.sleep(len(data) / self.bandwidth)
+        return data
+
+
+class FakeStreamer:
+    def __init__(self, data, bandwidth=None):
+        self.size = len(data)
+        self.input_stream = FakeInputStream(data, bandwidth)
+
+    def stream(self) -> FakeInputStream:
+        return self.input_stream
+
+
+class FakeLoadedStream:
+    def __init__(self, data, bandwidth=None):
+        self.input_stream = FakeStreamer(data, bandwidth)
+
+
+class FakeContentFeeder:
+    def __init__(self, data, bandwidth=None):
+        self.data = data
+        self.bandwidth = bandwidth
+
+    def load(self, playable_id, audio_quality, preload, halt_listener) -> FakeLoadedStream:
+        return FakeLoadedStream(self.data, self.bandwidth)
+
+
+class FakeTokenProvider:
+    def get_token(self, scope) -> TokenProvider.StoredToken:
+        # librespot's own token type, so its timestamp unit is the real one
+        return TokenProvider.StoredToken(
+            {"expiresIn": 3600, "accessToken": f"fake-{scope}", "scope": [scope]}
+        )
+
+    def get(self, scope) -> str:
+        return self.get_token(scope).access_token
+
+
+class FakeSession:
+    """Logged in premium librespot session serving the same Ogg for every track"""
+
+    def __init__(self, ogg_bytes, bandwidth=None):
+        """
+        Args:
+            ogg_bytes (bytes): Audio served for every track.
+            bandwidth (float): Bytes per second, None streams as fast as possible.
+        """
+        self.data = b"\x00" * HEADER_SIZE + ogg_bytes
+        self.bandwidth = bandwidth
+
+    def content_feeder(self) -> FakeContentFeeder:
+        return FakeContentFeeder(self.data, self.bandwidth)
+
+    def tokens(self) -> FakeTokenProvider:
+        return FakeTokenProvider()
+
+    def get_user_attribute(self, name):
+        return "premium" if name == "type" else None
+
+
+def make_audio(path, audio_format, seconds=30) -> bytes:
+    """Renders a sine tone with ffmpeg, e.g. the canned Ogg served by FakeSession"""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg is required to render the benchmark audio")
+
+    codec = {"ogg": "libvorbis", "mp3": "libmp3lame"}[audio_format]
+    subprocess.run(
+        [
+            ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+            "-ac", "2", "-codec:a", codec, "-b:a", "160k", str(path),
+        ],
+        check=True,
+    )
+    return path.read_bytes()
@@ -1,4 +1,4 @@
-from spotify_downloader import Spotify
+from spotify_downloader import ARTWORK_QUALITY, ARTWORK_SIZE, Spotify, jpeg_quality
 import argparse
 
 if __name__ == "__main__":
@@ -7,7 +7,7 @@ if __name__ == "__main__":
         "-l", "--login", help="Login to spotify account"
     )
     parser.add_argument(
-        "-tr", "--track", help="Downloads a track from their id or url"
+        "-tr", "--track", help="Downloads a track, album, playlist, artist or show from its url"
     )
     parser.add_argument(
         "-i", "--info", help="Url containing track"
@@ -15,6 +15,36 @@ if __name__ == "__main__":
     parser.add_argument(
         "-d", "--delete", help="Delete existing track"
     )
+    parser.add_argument(
+        "-s", "--serve", action="store_true", help="Run as a long-lived worker"
+    )
+    parser.add_argument(
+        "-p", "--port", type=int, help="Serve on 127.0.0.1:PORT instead of stdin/stdout"
+    )
+    parser.add_argument(
+        "--socket", help="Serve on a Unix socket at this path, only its owner can connect"
+    )
+    parser.add_argument(
+        "-m", "--metrics-port", type=int, help="Serve Prometheus metrics on 127.0.0.1:PORT/metrics"
+    )
+    parser.add_argument(
+        "-r", "--renditions", help="Extra outputs rendered from one download, e.g. mp3:128k,ogg"
+    )
+    parser.add_argument(
+        "--lazy", action="store_true", help="Only store the source audio, convert it on first --get"
+    )
+    parser.add_argument(
+        "-g", "--get", help="Returns a track in --rendition, converting its stored source on first request"
+    )
+    parser.add_argument(
+        "--rendition", help="Rendition returned by --get, e.g. mp3:128k, defaults to the main mp3"
+    )
+    parser.add_argument(
+        "--artwork-size", type=int, help=f"Longest side of embedded covers in pixels, 0 keeps them as served (default {ARTWORK_SIZE})"
+    )
+    parser.add_argument(
+        "--artwork-quality", type=jpeg_quality, help=f"JPEG quality of resized covers (default {ARTWORK_QUALITY})"
+    )
 
     args = parser.parse_args()
     
@@ -25,6 +55,10 @@ if __name__ == "__main__":
         spotify.start()
     elif args.info:
         spotify.get_info()
+    elif args.get:
+        spotify.get_track()
     elif args.delete:
         spotify.delete_track()
+    elif args.serve:
+        spotify.serve()
 
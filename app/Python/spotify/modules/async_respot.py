@@ -0,0 +1,350 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import asyncio
+import random
+
+import httpx
+
+from modules.metrics import metrics
+from modules.respot import Respot, RespotAuth, RespotRequest
+
+
+class AsyncRespot:
+    """asyncio front end of Respot.
+
+    Web API calls run on the event loop through httpx, librespot's blocking
+    session and stream reads run in a thread pool. Token refreshes and cache
+    lookups of the Web API client get their own small pool, so they never
+    queue behind long running downloads.
+    """
+
+    def __init__(self, respot: Respot, max_download_workers=8, max_request_workers=4):
+        self.respot = respot
+        self.auth: RespotAuth = respot.auth
+        self.request: AsyncRespotRequest = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_download_workers, thread_name_prefix="async-respot"
+        )
+        self.request_executor = ThreadPoolExecutor(
+            max_workers=max_request_workers, thread_name_prefix="async-respot-request"
+        )
+
+    async def _run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    async def is_authenticated(self, username=None, password=None) -> bool:
+        if await self._run_blocking(self.respot.is_authenticated, username, password):
+            self.request = AsyncRespotRequest(
+                self.auth, self.respot.metadata_cache, executor=self.request_executor
+            )
+            return True
+        return False
+
+    async def download(self, track_id, temp_path: Path, extension, make_dirs=True) -> tuple:
+        return await self._run_blocking(
+            self.respot.download, track_id, temp_path, extension, make_dirs
+        )
+
+    async def close(self) -> None:
+        if self.request:
+            await self.request.close()
+        self.executor.shutdown(wait=False)
+        self.request_executor.shutdown(wait=False)
+
+
+class AsyncRespotRequest:
+    """asyncio version of RespotRequest with the same methods and results"""
+
+    TRACKS_BATCH_SIZE = RespotRequest.TRACKS_BATCH_SIZE
+    MAX_PARALLEL_REQUESTS = 32
+    POOL_SIZE = 64
+    TIMEOUT = RespotRequest.TIMEOUT
+    MAX_RETRIES = RespotRequest.MAX_RETRIES
+    BACKOFF_BASE = RespotRequest.BACKOFF_BASE
+    BACKOFF_MAX = RespotRequest.BACKOFF_MAX
+
+    def __init__(
+        self,
+        auth: RespotAuth,
+        cache=None,
+        pool_size=None,
+        timeout=None,
+        max_parallel_requests=None,
+        executor=None,
+    ):
+        """
+        Args:
+            pool_size (int): Maximum open connections of the httpx client.
+            max_parallel_requests (int): Concurrent requests for batches and pagination.
+            executor (Executor): Runs blocking token refreshes and cache lookups.
+        """
+        self.auth = auth
+        self.cache = cache
+        self.token = auth.token
+        self.token_your_libary = auth.token_your_libary
+        self.executor = executor
+        self.max_parallel_requests = max_parallel_requests or self.MAX_PARALLEL_REQUESTS
+
+        connect, read = timeout or self.TIMEOUT
+        pool_size = pool_size or self.POOL_SIZE
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+        )
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    async def _run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    async def authorized_get_request(self, url, library=False, retry_count=0, **kwargs):
+        """GET with the bearer token, retrying with backoff on transient failures.
+
+        Args:
+            library (bool): Sends the user-library-read token instead of the default one.
+        """
+
+        for attempt in range(retry_count, self.MAX_RETRIES + 1):
+            if not self.auth.has_valid_tokens():
+                await self._run_blocking(self.auth.refresh_token)
+            self.token, self.token_your_libary = self.auth.token, self.auth.token_your_libary
+            token_bearer = self.token_your_libary if library else self.token
+            metrics.inc("http_requests_total")
+            try:
+                response = await self.client.get(
+                    url, headers={"Authorization": f"Bearer {token_bearer}"}, **kwargs
+                )
+            except httpx.TransportError:
+                metrics.inc("http_retries_total", reason="connection")
+                await self._backoff(attempt)
+                continue
+
+            if response.status_code == 401:
+                metrics.inc("http_retries_total", reason="401")
+                await self._run_blocking(self.auth.refresh_token, token_bearer)
+                continue
+            if response.status_code == 429:
+                metrics.inc("http_retries_total", reason="429")
+                await self._backoff(attempt, response.headers.get("Retry-After"))
+                continue
+            if response.status_code >= 500:
+                metrics.inc("http_retries_total", reason="5xx")
+                await self._backoff(attempt)
+                continue
+            return response
+
+        raise RuntimeError("Connection Error: Too many retries")
+
+    async def _backoff(self, attempt, retry_after=None) -> None:
+        if attempt >= self.MAX_RETRIES:
+            return
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2**attempt))
+        await asyncio.sleep(min(delay, self.BACKOFF_MAX))
+
+    async def _gather_limited(self, coroutines) -> list:
+        semaphore = asyncio.Semaphore(self.max_parallel_requests)
+
+        async def limited(coroutine):
+            async with semaphore:
+                return await coroutine
+
+        return await asyncio.gather(*(limited(coroutine) for coroutine in coroutines))
+
+    async def get_track_info(self, track_id) -> dict:
+        """Retrieves metadata for downloaded songs"""
+        return (await self.get_tracks_info([track_id]))[0]
+
+    async def get_tracks_info(self, track_ids) -> list:
+        """Retrieves metadata for many songs, None for every missing track"""
+        track_ids = list(track_ids)
+        if not track_ids:
+            return []
+
+        tracks = {}
+        if self.cache:
+            keys = ["track:" + track_id for track_id in track_ids]
+            cached = await self._run_blocking(self.cache.get_many, keys)
+            tracks = {key.split(":", 1)[1]: track for key, track in cached.items()}
+
+        missing = list(dict.fromkeys(i for i in track_ids if i not in tracks))
+        if missing:
+            chunks = [
+                missing[i : i + self.TRACKS_BATCH_SIZE]
+                for i in range(0, len(missing), self.TRACKS_BATCH_SIZE)
+            ]
+            results = await self._gather_limited(
+                self._get_tracks_chunk(chunk) for chunk in chunks
+            )
+            fetched = dict(zip(missing, (track for chunk in results for track in chunk)))
+            if self.cache:
+                await self._run_blocking(
+                    self.cache.set_many,
+                    {"track:" + i: track for i, track in fetched.items() if track},
+                )
+            tracks.update(fetched)
+
+        return [tracks.get(track_id) for track_id in track_ids]
+
+    async def _get_tracks_chunk(self, track_ids) -> list:
+        try:
+            response = await self.authorized_get_request(
+                "https://api.spotify.com/v1/tracks?ids="
+                + ",".join(track_ids)
+                + "&market=from_token"
+            )
+            tracks = response.json()["tracks"]
+        except Exception as e:
+            return [None] * len(track_ids)
+
+        return [
+            RespotRequest._normalize_track_info(
+                track_id, tracks[index] if index < len(tracks) else None
+            )
+            for index, track_id in enumerate(track_ids)
+        ]
+
+    async def paginate(self, url, limit, params=None, library=False):
+        """Async generator over the items of every page, in order"""
+        params = dict(params or {})
+
+        async def get_page(offset):
+            response = await self.authorized_get_request(
+                url, library, params={**params, "limit": limit, "offset": offset}
+            )
+            return response.json()
+
+        resp = await get_page(0)
+        for item in resp["items"]:
+            yield item
+
+        total = resp.get("total")
+        if total is None:
+            offset = limit
+            while len(resp["items"]) == limit:
+                resp = await get_page(offset)
+                offset += limit
+                for item in resp["items"]:
+                    yield item
+            return
+
+        pages = await self._gather_limited(
+            get_page(offset) for offset in range(limit, total, limit)
+        )
+        for page in pages:
+            for item in page["items"]:
+                yield item
+
+    async def get_all_user_playlists(self):
+        """Returns list of users playlists"""
+        playlists = [
+            playlist
+            async for playlist in self.paginate("https://api.spotify.com/v1/me/playlists", 50)
+        ]
+        return {"playlists": playlists}
+
+    async def get_playlist_songs(self, playlist_id):
+        """returns list of songs in a playlist"""
+        return [
+            RespotRequest._parse_saved_song(song)
+            async for song in self.paginate(
+                f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks", 100
+            )
+            if song["track"] is not None
+        ]
+
+    async def get_playlist_info(self, playlist_id):
+        """Returns information scraped from playlist"""
+        response = await self.authorized_get_request(
+            f"https://api.spotify.com/v1/playlists/{playlist_id}?fields=name,owner(display_name)&market=from_token"
+        )
+        return RespotRequest._parse_playlist_info(playlist_id, response.json())
+
+    async def get_album_songs(self, album_id):
+        """Returns album tracklist"""
+        return [
+            RespotRequest._parse_album_song(song)
+            async for song in self.paginate(
+                f"https://api.spotify.com/v1/albums/{album_id}/tracks",
+                50,
+                params={"include_groups": "album,compilation"},
+            )
+        ]
+
+    async def get_album_info(self, album_id):
+        """Returns album name"""
+        response = await self.authorized_get_request(
+            f"https://api.spotify.com/v1/albums/{album_id}"
+        )
+        return RespotRequest._parse_album_info(response.json())
+
+    async def get_artist_albums(self, artists_id):
+        """returns list of albums in an artist"""
+        response = await self.authorized_get_request(
+            f"https://api.spotify.com/v1/artists/{artists_id}/albums",
+            params={"limit": 50, "include_groups": "album,compilation,single", "offset": 0},
+        )
+        return response.json()["items"]
+
+    async def get_liked_tracks(self):
+        """Returns user's saved tracks"""
+        return [
+            RespotRequest._parse_saved_song(song)
+            async for song in self.paginate(
+                "https://api.spotify.com/v1/me/tracks", 50, library=True
+            )
+        ]
+
+    async def get_artist_info(self, artist_id):
+        """Retrieves metadata for downloaded songs"""
+        try:
+            response = await self.authorized_get_request(
+                "https://api.spotify.com/v1/artists/" + artist_id
+            )
+            return RespotRequest._parse_artist_info(response.json())
+        except Exception as e:
+            return None
+
+    async def get_episode_info(self, episode_id_str):
+        response = await self.authorized_get_request(
+            "https://api.spotify.com/v1/episodes/" + episode_id_str
+        )
+        return RespotRequest._parse_episode_info(episode_id_str, response.json())
+
+    async def get_show_episodes(self, show_id):
+        """returns episodes of a show"""
+        return [
+            RespotRequest._parse_show_episode(episode)
+            async for episode in self.paginate(
+                f"https://api.spotify.com/v1/shows/{show_id}/episodes", 50
+            )
+        ]
+
+    async def get_show_info(self, show_id):
+        """returns show info"""
+        response = await self.authorized_get_request(
+            f"https://api.spotify.com/v1/shows/{show_id}"
+        )
+        return RespotRequest._parse_show_info(response.json())
+
+    async def search(self, search_term, search_limit):
+        """Searches Spotify's API for relevant data"""
+        response = await self.authorized_get_request(
+            "https://api.spotify.com/v1/search",
+            params={
+                "limit": search_limit,
+                "offset": "0",
+                "q": search_term,
+                "type": "track,album,playlist,artist",
+            },
+        )
+        return RespotRequest._parse_search(response.json())
@@ -0,0 +1,510 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from PIL import Image
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class MetadataCache:
+    """SQLite backed metadata cache with TTL expiry and LRU size limit"""
+
+    # Stays below SQLite's default limit of 999 variables per statement
+    BATCH_SIZE = 500
+
+    def __init__(self, file, ttl=86400, max_entries=10000):
+        """
+        Args:
+            file (Path): SQLite database file, usually under configs/.
+            ttl (int): Seconds an entry stays valid.
+            max_entries (int): Least recently used entries are evicted above this size.
+        """
+        self.file = file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.file), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS metadata_accessed_at ON metadata (accessed_at)"
+        )
+        self.connection.commit()
+
+    def get(self, key):
+        """Returns the cached value or None when missing or expired"""
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, created_at FROM metadata WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, created_at = row
+            if now - created_at > self.ttl:
+                self.connection.execute("DELETE FROM metadata WHERE key = ?", (key,))
+                self.connection.commit()
+                self.misses += 1
+                return None
+
+            self.connection.execute(
+                "UPDATE metadata SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.connection.commit()
+            self.hits += 1
+            return json.loads(value)
+
+    def get_many(self, keys) -> dict:
+        """Returns {key: value} for every key that is cached and still valid.
+
+        Looks keys up in chunks and touches them in one transaction, instead
+        of a SELECT, an UPDATE and a commit per key.
+        """
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        found = {}
+        expired = []
+        with self.lock:
+            for start in range(0, len(keys), self.BATCH_SIZE):
+                chunk = keys[start : start + self.BATCH_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                for key, value, created_at in self.connection.execute(
+                    f"SELECT key, value, created_at FROM metadata WHERE key IN ({placeholders})",
+                    chunk,
+                ):
+                    if now - created_at > self.ttl:
+                        expired.append(key)
+                    else:
+                        found[key] = value
+
+            if found or expired:
+                with self.connection:
+                    self.connection.executemany(
+                        "UPDATE metadata SET accessed_at = ? WHERE key = ?",
+                        [(now, key) for key in found],
+                    )
+                    self.connection.executemany(
+                        "DELETE FROM metadata WHERE key = ?", [(key,) for key in expired]
+                    )
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        return {key: json.loads(found[key]) for key in keys if key in found}
+
+    def set(self, key, value) -> None:
+        self.set_many({key: value})
+
+    def set_many(self, items: dict) -> None:
+        if not items:
+            return
+
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO metadata (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(key, json.dumps(value), now, now) for key, value in items.items()],
+            )
+            self._evict()
+            self.connection.commit()
+
+    def delete(self, key) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM metadata WHERE key = ?", (key,))
+            self.connection.commit()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM metadata")
+            self.connection.commit()
+
+    def _evict(self) -> None:
+        (size,) = self.connection.execute("SELECT COUNT(*) FROM metadata").fetchone()
+        excess = size - self.max_entries
+        if excess > 0:
+            self.connection.execute(
+                "DELETE FROM metadata WHERE key IN "
+                "(SELECT key FROM metadata ORDER BY accessed_at ASC LIMIT ?)",
+                (excess,),
+            )
+            self.evictions += excess
+
+    def stats(self) -> dict:
+        with self.lock:
+            (size,) = self.connection.execute("SELECT COUNT(*) FROM metadata").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def downscale_artwork(data, size, quality=85) -> bytes:
+    """Fits an image into size x size and recompresses it as JPEG.
+
+    The original is returned when the result would not be smaller.
+    """
+    with Image.open(BytesIO(data)) as image:
+        # Lets the JPEG decoder skip detail the thumbnail throws away anyway
+        image.draft("RGB", (size, size))
+        image = image.convert("RGB")
+    image.thumbnail((size, size), Image.LANCZOS)
+
+    output = BytesIO()
+    image.save(output, "JPEG", quality=quality, optimize=True)
+    resized = output.getvalue()
+    return resized if len(resized) < len(data) else data
+
+
+class ArtworkCache:
+    """Album art cache keyed by image URL, kept in memory and on disk.
+
+    Concurrent requests for the same URL share one HTTP fetch. Downscaled
+    covers are cached separately per (URL, size), the resizing runs in a
+    small thread pool since Pillow releases the GIL while it works.
+    """
+
+    def __init__(
+        self,
+        directory=None,
+        max_memory_bytes=32 * 1024 * 1024,
+        max_disk_bytes=512 * 1024 * 1024,
+        timeout=10,
+        pool_size=8,
+        quality=85,
+        max_workers=None,
+    ):
+        """
+        Args:
+            directory (Path): Folder for cached images, None keeps them in memory only.
+            max_memory_bytes (int): Size bound of the in-memory LRU.
+            max_disk_bytes (int): Size bound of the on-disk cache, oldest files go first.
+            timeout (int): Seconds to wait for the image host.
+            quality (int): JPEG quality of downscaled covers.
+            max_workers (int): Covers resized at once, defaults to the number of CPUs.
+        """
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.timeout = timeout
+        self.quality = quality
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._pool = None
+
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.resized = 0
+        self.saved_bytes = 0
+        self.lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(url) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self.lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="artwork"
+                    )
+        return self._pool
+
+    def get(self, url, size=None) -> bytes:
+        """Returns the image bytes or None when it cannot be fetched.
+
+        Args:
+            size (int): Longest side in pixels, the cover is downscaled and
+                recompressed to fit. None returns the original image.
+        """
+        if not url:
+            return None
+
+        key = url if not size else f"{url}#{size}q{self.quality}"
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            data = self._read_disk(key)
+            if data is None:
+                data = self._downscale(url, size) if size else self._fetch(url)
+                if data:
+                    self._write_disk(key, data)
+            else:
+                with self.lock:
+                    self.hits += 1
+
+            if data:
+                self._remember(key, data)
+            future.set_result(data)
+            return data
+        except Exception as e:
+            future.set_result(None)
+            return None
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+    def _downscale(self, url, size) -> bytes:
+        original = self.get(url)
+        if not original:
+            return None
+
+        try:
+            data = self.pool.submit(downscale_artwork, original, size, self.quality).result()
+        except Exception as e:
+            # Unreadable, too large or otherwise rejected by Pillow, embed it as it is
+            return original
+
+        with self.lock:
+            self.resized += 1
+            self.saved_bytes += len(original) - len(data)
+        return data
+
+    def _fetch(self, url) -> bytes:
+        with self.lock:
+            self.misses += 1
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def _remember(self, name, data) -> None:
+        with self.lock:
+            if name in self.memory:
+                return
+            self.memory[name] = data
+            self.memory_bytes += len(data)
+            while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_bytes -= len(evicted)
+
+    def _read_disk(self, name) -> bytes:
+        if not self.directory:
+            return None
+
+        path = self.directory / self.key(name)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        os.utime(path)
+        return data
+
+    def _write_disk(self, name, data) -> None:
+        if not self.directory:
+            return
+
+        path = self.directory / self.key(name)
+        part_path = path.with_suffix(".part")
+        part_path.write_bytes(data)
+        os.replace(part_path, path)
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".part"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "resized": self.resized,
+                "saved_bytes": self.saved_bytes,
+            }
+
+    def shutdown(self, wait=True) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+
+
+class DownloadCache:
+    """Index of finished downloads keyed by (track_id, audio_format, quality).
+
+    Files stay in the downloads folder and the least recently served ones
+    are deleted once their total size goes over max_bytes.
+    """
+
+    def __init__(self, file, max_bytes=10 * 1024 * 1024 * 1024):
+        self.file = file
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.file), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS downloads ("
+            "track_id TEXT NOT NULL, audio_format TEXT NOT NULL, quality TEXT NOT NULL, "
+            "path TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL, "
+            "PRIMARY KEY (track_id, audio_format, quality))"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS downloads_accessed_at ON downloads (accessed_at)"
+        )
+        self.connection.commit()
+
+    def get(self, track_id, audio_format, quality) -> str:
+        """Returns the path of a still valid download or None"""
+        key = (track_id, audio_format, str(quality))
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT path, size FROM downloads "
+                "WHERE track_id = ? AND audio_format = ? AND quality = ?",
+                key,
+            ).fetchone()
+
+            if row is not None:
+                path, size = row
+                try:
+                    valid = os.path.getsize(path) == size
+                except OSError:
+                    valid = False
+
+                if valid:
+                    self.connection.execute(
+                        "UPDATE downloads SET accessed_at = ? "
+                        "WHERE track_id = ? AND audio_format = ? AND quality = ?",
+                        (time.time(), *key),
+                    )
+                    self.connection.commit()
+                    self.hits += 1
+                    return path
+
+                # The file was removed or replaced behind our back
+                self._delete(key)
+                self.connection.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, track_id, audio_format, quality, path) -> None:
+        size = os.path.getsize(path)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO downloads "
+                "(track_id, audio_format, quality, path, size, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (track_id, audio_format, str(quality), str(path), size, time.time()),
+            )
+            self._evict(keep=str(path))
+            self.connection.commit()
+
+    def remove_path(self, path) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM downloads WHERE path = ?", (str(path),))
+            self.connection.commit()
+
+    def _delete(self, key) -> None:
+        self.connection.execute(
+            "DELETE FROM downloads WHERE track_id = ? AND audio_format = ? AND quality = ?",
+            key,
+        )
+
+    def _evict(self, keep=None) -> None:
+        (total,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM downloads"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+
+        rows = self.connection.execute(
+            "SELECT track_id, audio_format, quality, path, size FROM downloads "
+            "ORDER BY accessed_at ASC"
+        ).fetchall()
+        for track_id, audio_format, quality, path, size in rows:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            self._delete((track_id, audio_format, quality))
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            size, total = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM downloads"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "bytes": total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
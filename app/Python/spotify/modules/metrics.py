@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+
+class Metrics:
+    """Process wide counters and stage timers.
+
+    Stages are timed with `with metrics.timer("download"):`, counters are
+    bumped with metrics.inc(). render() returns the Prometheus text format.
+    """
+
+    def __init__(self, prefix="spotify"):
+        self.prefix = prefix
+        self.counters = {}
+        self.timers = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels) -> tuple:
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, value=1, **labels) -> None:
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, stage, seconds) -> None:
+        with self.lock:
+            count, total, longest = self.timers.get(stage, (0, 0.0, 0.0))
+            self.timers[stage] = (count + 1, total + seconds, max(longest, seconds))
+
+    @contextmanager
+    def timer(self, stage):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started_at)
+
+    def counter(self, name, **labels):
+        with self.lock:
+            return self.counters.get(self._key(name, labels), 0)
+
+    def timings(self) -> dict:
+        """Returns {stage: {"count", "seconds", "max"}} plus the download speed"""
+        with self.lock:
+            timings = {
+                stage: {"count": count, "seconds": round(total, 4), "max": round(longest, 4)}
+                for stage, (count, total, longest) in sorted(self.timers.items())
+            }
+            _, seconds, _ = self.timers.get("download", (0, 0.0, 0.0))
+        downloaded = self.counter("downloaded_bytes_total")
+        if downloaded and seconds:
+            timings["bytes_per_second"] = round(downloaded / seconds)
+        return timings
+
+    def render(self, gauges=None) -> str:
+        """Prometheus text exposition of every metric.
+
+        Args:
+            gauges (dict): Extra {(name, labels): value} sampled by the caller, e.g. cache sizes.
+        """
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(self.timers.items())
+
+        names = set()
+        for (name, labels), value in counters:
+            full_name = f"{self.prefix}_{name}"
+            if full_name not in names:
+                names.add(full_name)
+                lines.append(f"# TYPE {full_name} counter")
+            lines.append(f"{full_name}{self._labels(labels)} {value}")
+
+        if timers:
+            full_name = f"{self.prefix}_stage_seconds"
+            lines.append(f"# TYPE {full_name} summary")
+            for stage, (count, total, _) in timers:
+                labels = self._labels((("stage", stage),))
+                lines.append(f"{full_name}_count{labels} {count}")
+                lines.append(f"{full_name}_sum{labels} {total:.6f}")
+            lines.append(f"# TYPE {full_name}_max gauge")
+            for stage, (_, _, longest) in timers:
+                lines.append(f"{full_name}_max{self._labels((('stage', stage),))} {longest:.6f}")
+
+        for (name, labels), value in sorted((gauges or {}).items()):
+            full_name = f"{self.prefix}_{name}"
+            if full_name not in names:
+                names.add(full_name)
+                lines.append(f"# TYPE {full_name} gauge")
+            lines.append(f"{full_name}{self._labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(labels) -> str:
+        if not labels:
+            return ""
+        pairs = ",".join(f'{key}="{value}"' for key, value in labels)
+        return "{" + pairs + "}"
+
+
+def serve_metrics(render, host="127.0.0.1", port=9765) -> ThreadingHTTPServer:
+    """Serves render() on GET /metrics from a background thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+metrics = Metrics()
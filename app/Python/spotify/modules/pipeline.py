@@ -0,0 +1,239 @@
+import os
+import queue
+import threading
+import time
+
+from modules.metrics import metrics
+from modules.respot import RespotTrackHandler, transcode_file
+
+
+class PipelineJob:
+    """One track moving through the pipeline"""
+
+    def __init__(self, track_id, path=None, caller=None, on_status=None):
+        self.track_id = track_id
+        self.path = path
+        self.caller = caller
+        self.on_status = on_status
+        self.status = "queued"
+        self.timings = {}
+        self.result = None
+
+        self.owns_flight = False
+        self.track = None
+        self.source_path = None
+        # Quality of the account that streamed the source
+        self.quality = None
+        self.output_path = None
+        # Rendition mode: {rendition: path} to render, then the outcome
+        self.targets = None
+        self.headers = {}
+        self.outputs = {}
+        self.errors = {}
+        self.tagged = False
+
+        self.started_at = time.monotonic()
+        self.stage_started_at = self.started_at
+        self.done = threading.Event()
+
+    def wait(self, timeout=None) -> dict:
+        self.done.wait(timeout)
+        return self.result
+
+
+class DownloadPipeline:
+    """Runs download, transcode and tag stages side by side.
+
+    Stages are connected by bounded queues, so a slow stage makes the ones
+    before it wait instead of piling up files on disk. Sustained throughput
+    approaches the slowest stage rather than the sum of all three.
+    """
+
+    STOP = object()
+
+    def __init__(
+        self,
+        spotify,
+        download_workers=4,
+        transcode_workers=None,
+        tag_workers=2,
+        queue_size=8,
+        on_status=None,
+    ):
+        """
+        Args:
+            spotify (Spotify): Provides the session, archive, tagger and rendition transcoder.
+            transcode_workers (int): Jobs transcoded at once, defaults to the number of CPUs.
+            queue_size (int): Maximum number of jobs waiting in front of each stage.
+            on_status (callable): Called with the job on every status change.
+        """
+        self.spotify = spotify
+        self.on_status = on_status
+        # Each transcode thread waits on its own ffmpeg process
+        self.transcode_workers = transcode_workers or os.cpu_count() or 1
+
+        self.download_queue = queue.Queue(maxsize=queue_size)
+        self.transcode_queue = queue.Queue(maxsize=queue_size)
+        self.tag_queue = queue.Queue(maxsize=queue_size)
+
+        self.stages = [
+            (self.download_queue, self._download, download_workers),
+            (self.transcode_queue, self._transcode, self.transcode_workers),
+            (self.tag_queue, self._tag, tag_workers),
+        ]
+        self.threads = []
+        for stage_queue, handler, workers in self.stages:
+            threads = []
+            for _ in range(workers):
+                thread = threading.Thread(
+                    target=self._worker, args=(stage_queue, handler), daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+            self.threads.append(threads)
+
+    def submit(self, track_id, path=None, caller=None, on_status=None) -> PipelineJob:
+        """Queues a track, blocks while the download stage is full"""
+        job = PipelineJob(track_id, path, caller, on_status)
+        self._notify(job)
+        self.download_queue.put(job)
+        return job
+
+    def run(self, track_ids, path=None, caller=None, on_status=None) -> list:
+        """Downloads every track, results come back in input order"""
+        jobs = [self.submit(track_id, path, caller, on_status) for track_id in track_ids]
+        return [job.wait() for job in jobs]
+
+    def close(self) -> None:
+        """Lets queued jobs finish, then stops the stages from first to last"""
+        for (stage_queue, _, workers), threads in zip(self.stages, self.threads):
+            for _ in range(workers):
+                stage_queue.put(self.STOP)
+            for thread in threads:
+                thread.join()
+
+    def _worker(self, stage_queue, handler) -> None:
+        while True:
+            job = stage_queue.get()
+            if job is self.STOP:
+                return
+            try:
+                handler(job)
+            except Exception as e:
+                self._finish(job, {"status": "download-error", "message": str(e), "data": ""})
+
+    def _set_status(self, job, status) -> None:
+        now = time.monotonic()
+        if job.status not in ("done", "error"):
+            job.timings[job.status] = now - job.stage_started_at
+        job.status = status
+        job.stage_started_at = now
+        self._notify(job)
+
+    def _notify(self, job) -> None:
+        for callback in (self.on_status, job.on_status):
+            if callback:
+                callback(job)
+
+    def _finish(self, job, result) -> None:
+        if job.owns_flight:
+            job.owns_flight = False
+            self.spotify.flights.end(job.track_id, result)
+        job.result = result
+        job.timings["total"] = time.monotonic() - job.started_at
+        done = result.get("status") in ("download-success", "source-stored")
+        self._set_status(job, "done" if done else "error")
+        job.done.set()
+
+    def _download(self, job) -> None:
+        future, job.owns_flight = self.spotify.flights.begin(job.track_id)
+        if not job.owns_flight:
+            # Another request is downloading the same track, share its result
+            self._finish(job, future.result())
+            return
+
+        cached = self.spotify.cached_download(job.track_id)
+        if cached:
+            self._finish(job, cached)
+            return
+
+        self._set_status(job, "downloading")
+        track, temp_path, error = self.spotify.prepare_track(
+            job.track_id, job.path, job.caller
+        )
+        if error:
+            self._finish(job, error)
+            return
+
+        job.track = track
+        job.output_path = temp_path
+        if self.spotify.lazy:
+            source_path, _ = self.spotify.fetch_source(job.track_id)
+            self._finish(job, self.spotify.source_result(source_path))
+            return
+
+        if self.spotify.renditions:
+            # Keep the source and render every missing rendition from it
+            job.source_path, job.quality = self.spotify.fetch_source(job.track_id)
+            if not job.source_path:
+                self._finish(job, {"status": "download-error", "message": "Failed to download track."})
+                return
+            job.targets = self.spotify.rendition_targets(
+                job.track_id, temp_path, quality=job.quality
+            )
+            self._set_status(job, "waiting-transcode")
+            self.transcode_queue.put(job)
+            return
+
+        job.source_path, job.quality = self.spotify.respot.download(
+            job.track_id, temp_path, "source", True
+        )
+        if not job.source_path:
+            self._finish(job, {"status": "download-error", "message": "Failed to download track."})
+            return
+
+        if job.source_path.suffix == job.output_path.suffix:
+            job.output_path = job.source_path
+            self._set_status(job, "waiting-tag")
+            self.tag_queue.put(job)
+        else:
+            self._set_status(job, "waiting-transcode")
+            self.transcode_queue.put(job)
+
+    def _transcode(self, job) -> None:
+        self._set_status(job, "transcoding")
+        if job.targets is not None:
+            job.headers = self.spotify.tag_headers(job.track, job.targets)
+            with metrics.timer("transcode"):
+                job.outputs, job.errors = self.spotify.transcoder.render(
+                    job.source_path, job.targets, job.headers
+                )
+            self._set_status(job, "waiting-tag")
+            self.tag_queue.put(job)
+            return
+
+        bitrate = RespotTrackHandler.bitrate_for(job.quality)
+        header = self.spotify.tag_header(job.track, self.spotify.audio_format)
+        try:
+            with metrics.timer("transcode"):
+                transcode_file(
+                    job.source_path, job.output_path, self.spotify.audio_format, bitrate, header
+                )
+            job.tagged = header is not None
+        finally:
+            job.source_path.unlink(missing_ok=True)
+
+        self._set_status(job, "waiting-tag")
+        self.tag_queue.put(job)
+
+    def _tag(self, job) -> None:
+        self._set_status(job, "tagging")
+        if job.targets is not None:
+            result = self.spotify.finish_renditions(
+                job.track_id, job.track, job.targets, job.outputs, job.errors, job.headers, job.quality
+            )
+        else:
+            result = self.spotify.finish_track(
+                job.track_id, job.track, job.output_path, job.quality, tagged=job.tagged
+            )
+        self._finish(job, result)
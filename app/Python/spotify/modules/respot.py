@@ -1,82 +1,275 @@
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import json
+import os
+import random
 import re
 import requests
 import time
 import shutil
+import tempfile
+import threading
 
 from librespot.audio.decoders import AudioQuality, VorbisOnlyAudioQuality
 from librespot.core import ApiClient, Session
 from librespot.metadata import TrackId, EpisodeId
-from pydub import AudioSegment
+from librespot.audio import CdnManager
+from librespot.structure import FeederException
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
+from modules.metrics import metrics
+from modules.transcoder import transcode
+
 
 class Respot:
     def __init__(
-        self, config_dir, force_premium, credentials, audio_format, antiban_wait_time
+        self,
+        config_dir,
+        force_premium,
+        credentials,
+        audio_format,
+        antiban_wait_time,
+        limiter=None,
+        metadata_cache=None,
+        extra_credentials=(),
+        limiter_factory=None,
+        partial_dir=None,
     ):
+        """
+        Args:
+            extra_credentials (list): More credential files, downloads are spread over all accounts.
+            limiter_factory (callable): Builds the limiter of each extra account from its credentials
+                file, shares limiter when None.
+            partial_dir (Path): Keeps partial downloads and their journals so retries resume.
+        """
         self.config_dir: Path = config_dir
         self.credentials: Path = credentials
         self.force_premium: bool = force_premium
         self.audio_format: str = audio_format
         self.antiban_wait_time: int = antiban_wait_time
+        # When a limiter paces downloads it replaces the fixed anti-ban sleep
+        self.limiter = limiter
+        self.metadata_cache = metadata_cache
+        self.extra_credentials = list(extra_credentials)
+        self.limiter_factory = limiter_factory
+        self.partial_dir = partial_dir
         self.auth: RespotAuth = RespotAuth(self.credentials, self.force_premium)
         self.request: RespotRequest = None
+        self.session_pool: RespotSessionPool = None
 
     def is_authenticated(self, username=None, password=None) -> bool:
         if self.auth.login(username, password):
-            self.request = RespotRequest(self.auth)
+            self.request = RespotRequest(self.auth, self.metadata_cache)
+            if self.extra_credentials and self.session_pool is None:
+                self.session_pool = self._create_session_pool()
             return True
         return False
 
-    def download(self, track_id, temp_path: Path, extension, make_dirs=True) -> str:
+    def _create_session_pool(self):
+        sessions = [RespotPooledSession(self.auth, self.limiter)]
+        for credentials in self.extra_credentials:
+            limiter = self.limiter_factory(credentials) if self.limiter_factory else self.limiter
+            sessions.append(
+                RespotPooledSession(RespotAuth(credentials, self.force_premium), limiter)
+            )
+        pool = RespotSessionPool(sessions)
+        pool.health_check()
+        return pool
+
+    def download(self, track_id, temp_path: Path, extension, make_dirs=True, header=None) -> tuple:
+        """Returns (output path, quality), the quality of the account that streamed the track"""
+        pooled = self.session_pool.acquire() if self.session_pool else None
+        auth = pooled.auth if pooled else self.auth
+        limiter = pooled.limiter if pooled else self.limiter
+
+        antiban_wait_time = 0 if limiter else self.antiban_wait_time
         handler = RespotTrackHandler(
-            self.auth, self.audio_format, self.antiban_wait_time, self.auth.quality
+            auth, self.audio_format, antiban_wait_time, auth.quality
         )
         if make_dirs:
             handler.create_out_dirs(temp_path.parent)
 
-        # Download the audio
+        # Stream the audio into a temp file next to its final location
         filename = temp_path.stem
-        audio_bytes = handler.download_audio(track_id, filename)
+        part_path = None
+        try:
+            if limiter:
+                with metrics.timer("anti_ban_wait"):
+                    limiter.acquire()
+            part_path = handler.download_audio_to_file(
+                track_id, temp_path.parent, self.partial_dir
+            )
+        finally:
+            if pooled:
+                # Unavailable or truncated tracks are not the account's fault
+                self.session_pool.release(pooled, healthy=not handler.session_failed)
+
+        metrics.inc("downloads_total", result="error" if part_path is None else "success")
+        if limiter:
+            if part_path is None:
+                limiter.report_failure()
+            else:
+                limiter.report_success()
 
-        if audio_bytes is None:
+        if part_path is None:
             # print(str(json.dumps({"status": "download-error", "message": "Failed to download track."})))
-            return ""
-
-        # Determine format of file downloaded
-        audio_bytes_format = handler.determine_file_extension(audio_bytes)
-
-        # Format handling
-        output_path = temp_path
-
-        if extension == audio_bytes_format:
-            # print(f"Saving {output_path.stem} directly")
-            handler.bytes_to_file(audio_bytes, output_path)
-        elif extension == "source":
-            output_str = filename + "." + audio_bytes_format
-            output_path = temp_path.parent / output_str
-            # print(f"Saving {filename} as {extension}")
-            handler.bytes_to_file(audio_bytes, output_path)
-        else:
-            output_str = filename + "." + extension
-            output_path = temp_path.parent / output_str
-            # print(f"Converting {filename} to {extension}")
-            handler.convert_audio_format(audio_bytes, output_path)
+            return "", auth.quality
+
+        try:
+            # Determine format of file downloaded
+            audio_bytes_format = handler.determine_file_extension_from_path(part_path)
+
+            # Format handling
+            output_path = temp_path
+
+            if extension == audio_bytes_format:
+                # print(f"Saving {output_path.stem} directly")
+                os.replace(part_path, output_path)
+            elif extension == "source":
+                output_str = filename + "." + audio_bytes_format
+                output_path = temp_path.parent / output_str
+                # print(f"Saving {filename} as {extension}")
+                os.replace(part_path, output_path)
+            else:
+                output_str = filename + "." + extension
+                output_path = temp_path.parent / output_str
+                # print(f"Converting {filename} to {extension}")
+                handler.convert_audio_file(part_path, output_path, header)
+        finally:
+            part_path.unlink(missing_ok=True)
 
         # print(str(json.dumps({"status": "download-success", "path": str(output_path)})))
-        return output_path
+        return output_path, auth.quality
+
+
+class RespotPooledSession:
+    """One account of the session pool with its load and health"""
+
+    def __init__(self, auth, limiter=None):
+        self.auth: RespotAuth = auth
+        self.limiter = limiter
+        self.in_flight = 0
+        self.failures = 0
+        self.quarantined_until = 0.0
+        self.checking = False
+
+    def is_healthy(self, now) -> bool:
+        return (
+            self.auth.session is not None
+            and not self.checking
+            and now >= self.quarantined_until
+        )
+
+
+class RespotSessionPool:
+    """Spreads downloads over several accounts.
+
+    Each download goes to the healthy session with the fewest downloads in
+    flight. A session failing MAX_FAILURES times in a row is quarantined
+    for QUARANTINE_SECONDS and health checked again before it is reused.
+    """
+
+    MAX_FAILURES = 3
+    QUARANTINE_SECONDS = 300
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.lock = threading.Lock()
+
+    def health_check(self) -> None:
+        """Logs in every session, failing ones are quarantined"""
+        for pooled in self.sessions:
+            if not self._check(pooled):
+                self._quarantine(pooled)
+
+    @staticmethod
+    def _check(pooled) -> bool:
+        try:
+            if pooled.auth.session is None:
+                pooled.auth.refresh_token()
+            pooled.auth._check_premium()
+            return True
+        except Exception as e:
+            pooled.auth.invalidate_session()
+            return False
+
+    def _quarantine(self, pooled) -> None:
+        pooled.quarantined_until = time.monotonic() + self.QUARANTINE_SECONDS
+        pooled.failures = 0
+
+    def _recheck_quarantined(self) -> None:
+        """Reconnects sessions whose quarantine is over before trusting them again"""
+        now = time.monotonic()
+        with self.lock:
+            due = [
+                pooled
+                for pooled in self.sessions
+                if pooled.quarantined_until and now >= pooled.quarantined_until and not pooled.checking
+            ]
+            for pooled in due:
+                pooled.checking = True
+
+        # A reconnect is a full handshake, other downloads must not wait for it
+        for pooled in due:
+            pooled.auth.invalidate_session()
+            healthy = self._check(pooled)
+            with self.lock:
+                pooled.checking = False
+                if healthy:
+                    pooled.quarantined_until = 0.0
+                else:
+                    self._quarantine(pooled)
+
+    def acquire(self) -> RespotPooledSession:
+        self._recheck_quarantined()
+        now = time.monotonic()
+        with self.lock:
+            healthy = [pooled for pooled in self.sessions if pooled.is_healthy(now)]
+            if not healthy:
+                raise RuntimeError("No healthy Spotify session available")
+
+            pooled = min(healthy, key=lambda pooled: pooled.in_flight)
+            pooled.in_flight += 1
+            return pooled
+
+    def release(self, pooled, healthy=True) -> None:
+        with self.lock:
+            pooled.in_flight -= 1
+            if healthy:
+                pooled.failures = 0
+                return
+            pooled.failures += 1
+            if pooled.failures >= self.MAX_FAILURES:
+                self._quarantine(pooled)
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        with self.lock:
+            return [
+                {
+                    "credentials": pooled.auth.credentials.name,
+                    "healthy": pooled.is_healthy(now),
+                    "in_flight": pooled.in_flight,
+                    "failures": pooled.failures,
+                }
+                for pooled in self.sessions
+            ]
 
 
 class RespotAuth:
+    TOKEN_SCOPES = ("user-read-email", "user-library-read")
+    # Refresh this many seconds before the access tokens expire
+    TOKEN_REFRESH_MARGIN = 30
+
     def __init__(self, credentials, force_premium):
         self.credentials = credentials
         self.force_premium = force_premium
         self.session = None
         self.token = None
         self.token_your_libary = None
+        self.token_expires_at = 0.0
+        self.token_lock = threading.Lock()
         self.quality = None
 
     def login(self, username, password):
@@ -117,7 +310,65 @@ class RespotAuth:
         except RuntimeError:
             return False
 
-    def refresh_token(self) -> (str, str):
+    def invalidate_session(self) -> None:
+        """Drops the session, the next refresh_token() reconnects"""
+        with self.token_lock:
+            self.session = None
+            self.token_expires_at = 0.0
+
+    def has_valid_tokens(self) -> bool:
+        return self.token is not None and time.time() < self.token_expires_at
+
+    def refresh_token(self, expired_token=None) -> (str, str):
+        """Returns valid (token, library token), renewing them only when needed.
+
+        Tokens come from the token provider of the running session, the
+        session is only rebuilt when it is missing or a rejected token
+        cannot be replaced through it.
+        """
+        with self.token_lock:
+            current = (self.token, self.token_your_libary)
+            if expired_token is not None and expired_token not in current:
+                # Another thread already replaced the rejected token
+                return current
+            if expired_token is None and self.session and self.has_valid_tokens():
+                return current
+
+            if self.session is None:
+                self._reconnect()
+            try:
+                self._fetch_tokens()
+            except Exception as e:
+                self._reconnect()
+                self._fetch_tokens()
+
+            if expired_token is not None and expired_token in (
+                self.token,
+                self.token_your_libary,
+            ):
+                # The provider still hands out the rejected token, the session is dead
+                self._reconnect()
+                self._fetch_tokens()
+
+            return (self.token, self.token_your_libary)
+
+    def _fetch_tokens(self) -> None:
+        provider = self.session.tokens()
+        token, token_your_libary = (
+            provider.get_token(scope) for scope in self.TOKEN_SCOPES
+        )
+        self.token = token.access_token
+        self.token_your_libary = token_your_libary.access_token
+        # StoredToken.timestamp is in microseconds
+        self.token_expires_at = (
+            min(
+                stored.timestamp / 1_000_000 + stored.expires_in
+                for stored in (token, token_your_libary)
+            )
+            - self.TOKEN_REFRESH_MARGIN
+        )
+
+    def _reconnect(self) -> None:
         self.session = (
             Session.Builder()
             .stored_file(stored_credentials=str(self.credentials))
@@ -125,9 +376,7 @@ class RespotAuth:
         )
         # Remove auto generated credentials.json
         Path("credentials.json").unlink(missing_ok=True)
-        self.token = self.session.tokens().get("user-read-email")
-        self.token_your_libary = self.session.tokens().get("user-library-read")
-        return (self.token, self.token_your_libary)
+        self.token_expires_at = 0.0
 
     def _check_premium(self) -> None:
         """If user has Spotify premium, return true"""
@@ -144,128 +393,269 @@ class RespotAuth:
 
 
 class RespotRequest:
-    def __init__(self, auth: RespotAuth):
+    TRACKS_BATCH_SIZE = 50
+    MAX_PARALLEL_REQUESTS = 4
+    POOL_SIZE = 16
+    TIMEOUT = (5, 30)
+    MAX_RETRIES = 4
+    BACKOFF_BASE = 0.5
+    BACKOFF_MAX = 30
+
+    def __init__(
+        self,
+        auth: RespotAuth,
+        cache=None,
+        pool_size=None,
+        timeout=None,
+        max_parallel_requests=None,
+    ):
+        """
+        Args:
+            pool_size (int): Keep-alive connections kept per host.
+            timeout (tuple): (connect, read) timeout in seconds for every request.
+            max_parallel_requests (int): Concurrent requests for batches and pagination.
+        """
         self.auth = auth
+        self.cache = cache
         self.token = auth.token
         self.token_your_libary = auth.token_your_libary
+        self.timeout = timeout or self.TIMEOUT
+        self.max_parallel_requests = max_parallel_requests or self.MAX_PARALLEL_REQUESTS
+
+        pool_size = pool_size or self.POOL_SIZE
+        self.session = requests.Session()
+        self.session.mount(
+            "https://",
+            HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size),
+        )
 
-    def authorized_get_request(self, url, token_bearer=None, retry_count=0, **kwargs):
-        if retry_count > 3:
-            raise RuntimeError("Connection Error: Too many retries")
+    def authorized_get_request(self, url, library=False, retry_count=0, **kwargs):
+        """GET with the bearer token, retrying with backoff on transient failures.
+
+        Args:
+            library (bool): Sends the user-library-read token instead of the default one.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(retry_count, self.MAX_RETRIES + 1):
+            if not self.auth.has_valid_tokens():
+                self.auth.refresh_token()
+            self.token, self.token_your_libary = self.auth.token, self.auth.token_your_libary
+            token_bearer = self.token_your_libary if library else self.token
+            metrics.inc("http_requests_total")
+            try:
+                response = self.session.get(
+                    url, headers={"Authorization": f"Bearer {token_bearer}"}, **kwargs
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                metrics.inc("http_retries_total", reason="connection")
+                self._backoff(attempt)
+                continue
 
-        token_bearer = token_bearer or self.token
-        try:
-            response = requests.get(
-                url, headers={"Authorization": f"Bearer {token_bearer}"}, **kwargs
-            )
             if response.status_code == 401:
                 # print("Token expired, refreshing...")
-                self.token, self.token_your_libary = self.auth.refresh_token()
-                return self.authorized_get_request(
-                    url, token_bearer, retry_count + 1, **kwargs
-                )
+                metrics.inc("http_retries_total", reason="401")
+                self.auth.refresh_token(token_bearer)
+                continue
+            if response.status_code == 429:
+                metrics.inc("http_retries_total", reason="429")
+                self._backoff(attempt, response.headers.get("Retry-After"))
+                continue
+            if response.status_code >= 500:
+                metrics.inc("http_retries_total", reason="5xx")
+                self._backoff(attempt)
+                continue
             return response
-        except requests.exceptions.ConnectionError:
-            return self.authorized_get_request(
-                url, token_bearer, retry_count + 1, **kwargs
-            )
+
+        raise RuntimeError("Connection Error: Too many retries")
+
+    def _backoff(self, attempt, retry_after=None) -> None:
+        """Sleeps for Retry-After when given, else exponential backoff with full jitter"""
+        if attempt >= self.MAX_RETRIES:
+            return
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2**attempt))
+        time.sleep(min(delay, self.BACKOFF_MAX))
 
     def get_track_info(self, track_id) -> dict:
         """Retrieves metadata for downloaded songs"""
+        return self.get_tracks_info([track_id])[0]
+
+    def get_tracks_info(self, track_ids) -> list:
+        """Retrieves metadata for many songs, None for every missing track"""
+        track_ids = list(track_ids)
+        if not track_ids:
+            return []
+
+        tracks = {}
+        if self.cache:
+            cached = self.cache.get_many("track:" + track_id for track_id in track_ids)
+            tracks = {key.split(":", 1)[1]: track for key, track in cached.items()}
+
+        missing = list(dict.fromkeys(i for i in track_ids if i not in tracks))
+        if missing:
+            fetched = dict(zip(missing, self._fetch_tracks_info(missing)))
+            if self.cache:
+                self.cache.set_many(
+                    {"track:" + i: track for i, track in fetched.items() if track}
+                )
+            tracks.update(fetched)
+
+        return [tracks.get(track_id) for track_id in track_ids]
+
+    def _fetch_tracks_info(self, track_ids) -> list:
+        chunks = [
+            track_ids[i : i + self.TRACKS_BATCH_SIZE]
+            for i in range(0, len(track_ids), self.TRACKS_BATCH_SIZE)
+        ]
+
+        if len(chunks) == 1:
+            return self._get_tracks_chunk(chunks[0])
+
+        with ThreadPoolExecutor(
+            max_workers=min(len(chunks), self.max_parallel_requests)
+        ) as executor:
+            results = executor.map(self._get_tracks_chunk, chunks)
+
+        return [track for chunk in results for track in chunk]
+
+    def _get_tracks_chunk(self, track_ids) -> list:
+        """Queries up to TRACKS_BATCH_SIZE tracks with a single request"""
         try:
             info = json.loads(
                 self.authorized_get_request(
                     "https://api.spotify.com/v1/tracks?ids="
-                    + track_id
+                    + ",".join(track_ids)
                     + "&market=from_token"
                 ).text
             )
+            tracks = info["tracks"]
+        except Exception as e:
+            # print("###   get_tracks_info - FAILED TO QUERY METADATA   ###")
+            # print("track_ids:", track_ids)
+            # print(e)
+            return [None] * len(track_ids)
 
+        results = []
+        for index, track_id in enumerate(track_ids):
+            track = tracks[index] if index < len(tracks) else None
+            results.append(self._normalize_track_info(track_id, track))
+        return results
+
+    @staticmethod
+    def _normalize_track_info(track_id, track) -> dict:
+        if not track:
+            return None
+
+        try:
             # Sum the size of the images, compares and saves the index of the
             # largest image size
             sum_total = []
-            for sum_px in info["tracks"][0]["album"]["images"]:
+            for sum_px in track["album"]["images"]:
                 sum_total.append(sum_px["height"] + sum_px["width"])
 
             img_index = sum_total.index(max(sum_total)) if sum_total else -1
 
-            artist_id = info["tracks"][0]["artists"][0]["id"]
+            artist_id = track["artists"][0]["id"]
 
-            artists = [data["name"] for data in info["tracks"][0]["artists"]]
+            artists = [data["name"] for data in track["artists"]]
 
             # TODO: Implement genre checking
             return {
                 "id": track_id,
                 "artist_id": artist_id,
                 "artist_name": RespotUtils.conv_artist_format(artists),
-                "album_artist": info["tracks"][0]["album"]["artists"][0]["name"],
-                "album_name": info["tracks"][0]["album"]["name"],
-                "audio_name": info["tracks"][0]["name"],
-                "image_url": info["tracks"][0]["album"]["images"][img_index]["url"] if img_index >= 0 else None,
-                "release_year": info["tracks"][0]["album"]["release_date"].split("-")[0],
-                "disc_number": info["tracks"][0]["disc_number"],
-                "audio_number": info["tracks"][0]["track_number"],
-                "scraped_song_id": info["tracks"][0]["id"],
-                "is_playable": info["tracks"][0]["is_playable"],
-                "release_date": info["tracks"][0]["album"]["release_date"],
+                "album_artist": track["album"]["artists"][0]["name"],
+                "album_name": track["album"]["name"],
+                "audio_name": track["name"],
+                "image_url": track["album"]["images"][img_index]["url"] if img_index >= 0 else None,
+                "release_year": track["album"]["release_date"].split("-")[0],
+                "disc_number": track["disc_number"],
+                "audio_number": track["track_number"],
+                "scraped_song_id": track["id"],
+                "is_playable": track["is_playable"],
+                "release_date": track["album"]["release_date"],
             }
 
         except Exception as e:
-            # print("###   get_track_info - FAILED TO QUERY METADATA   ###")
+            # print("###   get_track_info - FAILED TO PARSE METADATA   ###")
             # print("track_id:", track_id)
             # print(e)
             return None
 
-    def get_all_user_playlists(self):
-        """Returns list of users playlists"""
-        playlists = []
-        limit = 50
-        offset = 0
+    def paginate(self, url, limit, params=None, library=False):
+        """Yields the items of every page in order.
 
-        while True:
-            resp = self.authorized_get_request(
-                "https://api.spotify.com/v1/me/playlists",
-                params={"limit": limit, "offset": offset},
+        The first page tells the total, the remaining pages are then fetched
+        concurrently, at most max_parallel_requests at a time.
+        """
+        params = dict(params or {})
+
+        def get_page(offset):
+            return self.authorized_get_request(
+                url, library, params={**params, "limit": limit, "offset": offset}
             ).json()
-            offset += limit
-            playlists.extend(resp["items"])
 
-            if len(resp["items"]) < limit:
-                break
+        resp = get_page(0)
+        yield from resp["items"]
+
+        total = resp.get("total")
+        if total is None:
+            # No total given, walk the pages one by one until a short one
+            offset = limit
+            while len(resp["items"]) == limit:
+                resp = get_page(offset)
+                offset += limit
+                yield from resp["items"]
+            return
+
+        offsets = range(limit, total, limit)
+        if not offsets:
+            return
+
+        with ThreadPoolExecutor(
+            max_workers=min(len(offsets), self.max_parallel_requests)
+        ) as executor:
+            for page in executor.map(get_page, offsets):
+                yield from page["items"]
 
+    def get_all_user_playlists(self):
+        """Returns list of users playlists"""
+        playlists = list(
+            self.paginate("https://api.spotify.com/v1/me/playlists", 50)
+        )
         return {"playlists": playlists}
 
     def get_playlist_songs(self, playlist_id):
         """returns list of songs in a playlist"""
-        offset = 0
-        limit = 100
         audios = []
 
-        while True:
-            resp = self.authorized_get_request(
-                f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks",
-                params={"limit": limit, "offset": offset},
-            ).json()
-            offset += limit
-            for song in resp["items"]:
-                if song["track"] is not None:
-                    audios.append(
-                        {
-                            "id": song["track"]["id"],
-                            "name": song["track"]["name"],
-                            "artist": song["track"]["artists"][0]["name"],
-                        }
-                    )
-
-            if len(resp["items"]) < limit:
-                break
+        for song in self.paginate(
+            f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks", 100
+        ):
+            if song["track"] is not None:
+                audios.append(self._parse_saved_song(song))
         return audios
 
+    @staticmethod
+    def _parse_saved_song(song) -> dict:
+        return {
+            "id": song["track"]["id"],
+            "name": song["track"]["name"],
+            "artist": song["track"]["artists"][0]["name"],
+        }
+
     def get_playlist_info(self, playlist_id):
         """Returns information scraped from playlist"""
         resp = self.authorized_get_request(
             f"https://api.spotify.com/v1/playlists/{playlist_id}?fields=name,owner(display_name)&market=from_token"
         ).json()
+        return self._parse_playlist_info(playlist_id, resp)
+
+    @staticmethod
+    def _parse_playlist_info(playlist_id, resp) -> dict:
         return {
             "name": resp["name"].strip(),
             "owner": resp["owner"]["display_name"].strip(),
@@ -275,41 +665,35 @@ class RespotRequest:
     def get_album_songs(self, album_id):
         """Returns album tracklist"""
         audios = []
-        offset = 0
-        limit = 50
         include_groups = "album,compilation"
 
-        while True:
-            resp = self.authorized_get_request(
-                f"https://api.spotify.com/v1/albums/{album_id}/tracks",
-                params={
-                    "limit": limit,
-                    "include_groups": include_groups,
-                    "offset": offset,
-                },
-            ).json()
-            offset += limit
-            for song in resp["items"]:
-                audios.append(
-                    {
-                        "id": song["id"],
-                        "name": song["name"],
-                        "number": song["track_number"],
-                        "disc_number": song["disc_number"],
-                    }
-                )
-
-            if len(resp["items"]) < limit:
-                break
+        for song in self.paginate(
+            f"https://api.spotify.com/v1/albums/{album_id}/tracks",
+            50,
+            params={"include_groups": include_groups},
+        ):
+            audios.append(self._parse_album_song(song))
 
         return audios
 
+    @staticmethod
+    def _parse_album_song(song) -> dict:
+        return {
+            "id": song["id"],
+            "name": song["name"],
+            "number": song["track_number"],
+            "disc_number": song["disc_number"],
+        }
+
     def get_album_info(self, album_id):
         """Returns album name"""
         resp = self.authorized_get_request(
             f"https://api.spotify.com/v1/albums/{album_id}"
         ).json()
+        return self._parse_album_info(resp)
 
+    @staticmethod
+    def _parse_album_info(resp) -> dict:
         artists = []
         for artist in resp["artists"]:
             artists.append(RespotUtils.sanitize_data(artist["name"]))
@@ -368,27 +752,11 @@ class RespotRequest:
     def get_liked_tracks(self):
         """Returns user's saved tracks"""
         songs = []
-        offset = 0
-        limit = 50
 
-        while True:
-            resp = self.authorized_get_request(
-                "https://api.spotify.com/v1/me/tracks",
-                self.token_your_libary,
-                params={"limit": limit, "offset": offset},
-            ).json()
-            offset += limit
-            for song in resp["items"]:
-                songs.append(
-                    {
-                        "id": song["track"]["id"],
-                        "name": song["track"]["name"],
-                        "artist": song["track"]["artists"][0]["name"],
-                    }
-                )
-
-            if len(resp["items"]) < limit:
-                break
+        for song in self.paginate(
+            "https://api.spotify.com/v1/me/tracks", 50, library=True
+        ):
+            songs.append(self._parse_saved_song(song))
 
         return songs
 
@@ -402,22 +770,30 @@ class RespotRequest:
                 ).text
             )
 
-            return {
-                "name": RespotUtils.sanitize_data(info["name"]),
-                "genres": RespotUtils.conv_artist_format(info["genres"]),
-            }
+            return self._parse_artist_info(info)
         except Exception as e:
             # print("###   get_artist_info - FAILED TO QUERY METADATA   ###")
             # print("artist_id:", artist_id)
             # print(e)
             pass
 
+    @staticmethod
+    def _parse_artist_info(info) -> dict:
+        return {
+            "name": RespotUtils.sanitize_data(info["name"]),
+            "genres": RespotUtils.conv_artist_format(info["genres"]),
+        }
+
     def get_episode_info(self, episode_id_str):
         info = json.loads(
             self.authorized_get_request(
                 "https://api.spotify.com/v1/episodes/" + episode_id_str
             ).text
         )
+        return self._parse_episode_info(episode_id_str, info)
+
+    @staticmethod
+    def _parse_episode_info(episode_id_str, info) -> dict:
         if not info:
             return None
         sum_total = []
@@ -444,34 +820,31 @@ class RespotRequest:
     def get_show_episodes(self, show_id):
         """returns episodes of a show"""
         episodes = []
-        offset = 0
-        limit = 50
 
-        while True:
-            resp = self.authorized_get_request(
-                f"https://api.spotify.com/v1/shows/{show_id}/episodes",
-                params={"limit": limit, "offset": offset},
-            ).json()
-            offset += limit
-            for episode in resp["items"]:
-                episodes.append(
-                    {
-                        "id": episode["id"],
-                        "name": episode["name"],
-                        "release_date": episode["release_date"],
-                    }
-                )
-
-            if len(resp["items"]) < limit:
-                break
+        for episode in self.paginate(
+            f"https://api.spotify.com/v1/shows/{show_id}/episodes", 50
+        ):
+            episodes.append(self._parse_show_episode(episode))
 
         return episodes
 
+    @staticmethod
+    def _parse_show_episode(episode) -> dict:
+        return {
+            "id": episode["id"],
+            "name": episode["name"],
+            "release_date": episode["release_date"],
+        }
+
     def get_show_info(self, show_id):
         """returns show info"""
         resp = self.authorized_get_request(
             f"https://api.spotify.com/v1/shows/{show_id}"
         ).json()
+        return self._parse_show_info(resp)
+
+    @staticmethod
+    def _parse_show_info(resp) -> dict:
         return {
             "name": RespotUtils.sanitize_data(resp["name"]),
             "publisher": resp["publisher"],
@@ -491,9 +864,12 @@ class RespotRequest:
                 "type": "track,album,playlist,artist",
             },
         )
+        return self._parse_search(resp.json())
 
+    @staticmethod
+    def _parse_search(resp) -> dict:
         ret_tracks = []
-        tracks = resp.json()["tracks"]["items"]
+        tracks = resp["tracks"]["items"]
         if len(tracks) > 0:
             for track in tracks:
                 if track["explicit"]:
@@ -511,7 +887,7 @@ class RespotRequest:
                 )
 
         ret_albums = []
-        albums = resp.json()["albums"]["items"]
+        albums = resp["albums"]["items"]
         if len(albums) > 0:
             for album in albums:
                 _year = re.search("(\\d{4})", album["release_date"]).group(1)
@@ -528,7 +904,7 @@ class RespotRequest:
                 )
 
         ret_playlists = []
-        playlists = resp.json()["playlists"]["items"]
+        playlists = resp["playlists"]["items"]
         for playlist in playlists:
             ret_playlists.append(
                 {
@@ -540,7 +916,7 @@ class RespotRequest:
             )
 
         ret_artists = []
-        artists = resp.json()["artists"]["items"]
+        artists = resp["artists"]["items"]
         for artist in artists:
             ret_artists.append(
                 {
@@ -582,87 +958,171 @@ class RespotTrackHandler:
         self.format = audio_format
         self.antiban_wait_time = antiban_wait_time
         self.quality = quality
+        # Set when the last stream could not be opened because of the session
+        self.session_failed = False
 
     def create_out_dirs(self, parent_path) -> None:
         parent_path.mkdir(parents=True, exist_ok=True)
 
-    def download_audio(self, track_id, filename) -> BytesIO:
-        """Downloads raw song audio from Spotify"""
-        # TODO: ADD disc_number IF > 1
+    def _load_stream(self, track_id):
+        with metrics.timer("stream_open"):
+            try:
+                return self._open_stream(track_id)
+            except Exception as e:
+                self.session_failed = self._is_session_error(e)
+                raise
+
+    @staticmethod
+    def _is_session_error(error) -> bool:
+        """Whether a stream failed to open because of the account rather than the track"""
+        if isinstance(error, (FeederException, ApiClient.StatusCodeException, CdnManager.CdnException)):
+            return False
+        # librespot raises RuntimeError for restricted, unknown or unavailable content
+        return not isinstance(error, RuntimeError) or "authenticated" in str(error)
 
+    def _open_stream(self, track_id):
         try:
-            try:
-                _track_id = TrackId.from_base62(track_id)
-                stream = self.auth.session.content_feeder().load(
-                    _track_id, VorbisOnlyAudioQuality(self.quality), False, None
-                )
-            except ApiClient.StatusCodeException:
-                _track_id = EpisodeId.from_base62(track_id)
-                stream = self.auth.session.content_feeder().load(
-                    _track_id, VorbisOnlyAudioQuality(self.quality), False, None
-                )
+            _track_id = TrackId.from_base62(track_id)
+            return self.auth.session.content_feeder().load(
+                _track_id, VorbisOnlyAudioQuality(self.quality), False, None
+            )
+        except ApiClient.StatusCodeException:
+            _track_id = EpisodeId.from_base62(track_id)
+            return self.auth.session.content_feeder().load(
+                _track_id, VorbisOnlyAudioQuality(self.quality), False, None
+            )
 
-            total_size = stream.input_stream.size
-            downloaded = 0
-            fail_count = 0
-            audio_bytes = BytesIO()
-            # progress_bar = tqdm(total=total_size, unit="B", unit_scale=True)
+    def _read_stream(self, stream, output, on_progress=None) -> int:
+        """Copies the stream into output from its current position.
 
-            while downloaded < total_size:
-                remaining = total_size - downloaded
-                read_size = min(self.CHUNK_SIZE, remaining)
-                data = stream.input_stream.stream().read(read_size)
+        Returns the end offset, raises IOError when the stream stops before
+        its total size.
+        """
+        input_stream = stream.input_stream.stream()
+        total_size = stream.input_stream.size
+        # librespot already skipped the header, so count from the stream position
+        start = offset = input_stream.pos()
+        fail_count = 0
+        # progress_bar = tqdm(total=total_size, unit="B", unit_scale=True)
+
+        with metrics.timer("download"):
+            while offset < total_size:
+                read_size = min(self.CHUNK_SIZE, total_size - offset)
+                data = input_stream.read(read_size)
 
                 if not data:
                     fail_count += 1
                     if fail_count > self.RETRY_DOWNLOAD:
                         break
-                else:
-                    fail_count = 0  # reset fail_count on successful data read
+                    continue
+                fail_count = 0  # reset fail_count on successful data read
 
-                downloaded += len(data)
+                output.write(data)
+                offset += len(data)
                 # progress_bar.update(len(data))
-                audio_bytes.write(data)
-                # print(str(json.dumps({"status": "downloading", "progress": downloaded})))
+                if on_progress:
+                    on_progress(offset)
+                # print(str(json.dumps({"status": "downloading", "progress": offset})))
+
+        # progress_bar.close()
+        metrics.inc("downloaded_bytes_total", offset - start)
+        if offset < total_size:
+            metrics.inc("truncated_downloads_total")
+            raise IOError(f"Stream truncated at {offset} of {total_size} bytes")
+        return offset
+
+    def download_audio_to_file(self, track_id, output_dir: Path, journal_dir=None) -> Path:
+        """Streams raw song audio from Spotify into a temp file in output_dir.
+
+        With a journal_dir the bytes are collected there first, so a failed
+        or interrupted download resumes from the last recorded offset.
+        """
+        if journal_dir is not None:
+            return self._download_resumable(track_id, output_dir, journal_dir)
+
+        part_path = None
+        try:
+            stream = self._load_stream(track_id)
 
-            # progress_bar.close()
+            fd, part_path = tempfile.mkstemp(
+                prefix=f".{track_id}.", suffix=".part", dir=output_dir
+            )
+            part_path = Path(part_path)
+            with os.fdopen(fd, "wb") as output:
+                self._read_stream(stream, output)
 
             # Sleep to avoid ban
-            time.sleep(self.antiban_wait_time)
+            if self.antiban_wait_time:
+                with metrics.timer("anti_ban_wait"):
+                    time.sleep(self.antiban_wait_time)
 
-            audio_bytes.seek(0)
-
-            return audio_bytes
+            return part_path
 
         except Exception as e:
             # print("###   download_track - FAILED TO DOWNLOAD   ###")
             # print(e)
-            # print(track_id, filename)
-            # print(str(json.dumps({"status": "download-error", "message": "Failed to download track."})))
+            # print(track_id)
+            if part_path is not None:
+                part_path.unlink(missing_ok=True)
             return None
 
-    def convert_audio_format(self, audio_bytes: BytesIO, output_path: Path) -> None:
-        """Converts raw audio (ogg vorbis) to user specified format"""
-        # Make sure stream is at the start or else AudioSegment will act up
-        audio_bytes.seek(0)
+    def _download_resumable(self, track_id, output_dir: Path, journal_dir: Path) -> Path:
+        journal = RespotDownloadJournal(journal_dir, track_id, self.quality)
+        try:
+            stream = self._load_stream(track_id)
+            input_stream = stream.input_stream.stream()
 
-        bitrate = "160k"
-        if self.quality == AudioQuality.VERY_HIGH:
-            bitrate = "320k"
+            offset = journal.resume(stream.input_stream.size, input_stream.pos())
+            if offset > input_stream.pos():
+                metrics.inc("resumed_downloads_total")
+                input_stream.seek(offset)
 
-        AudioSegment.from_file(audio_bytes).export(
-            output_path, format=self.format, bitrate=bitrate
-        )
+            with open(journal.part_path, "ab") as output:
+                self._read_stream(stream, output, lambda end: journal.record(output, end))
+
+            # Sleep to avoid ban
+            if self.antiban_wait_time:
+                with metrics.timer("anti_ban_wait"):
+                    time.sleep(self.antiban_wait_time)
+
+            # Move next to the final location first, the rename into place stays atomic
+            fd, part_path = tempfile.mkstemp(
+                prefix=f".{track_id}.", suffix=".part", dir=output_dir
+            )
+            os.close(fd)
+            shutil.move(journal.part_path, part_path)
+            journal.discard()
+            return Path(part_path)
 
-    def bytes_to_file(self, audio_bytes: BytesIO, output_path: Path) -> None:
-        output_path.write_bytes(audio_bytes.getvalue())
+        except Exception as e:
+            # print("###   download_track - FAILED TO DOWNLOAD   ###")
+            # print(e)
+            # print(track_id)
+            # The partial file and its journal stay for the next attempt
+            return None
 
     @staticmethod
-    def determine_file_extension(audio_bytes: BytesIO) -> str:
-        """Get MIME type from BytesIO object"""
-        audio_bytes.seek(0)
-        magic_bytes = audio_bytes.read(16)
+    def bitrate_for(quality) -> str:
+        """Returns the export bitrate matching the Spotify playback quality"""
+        if quality == AudioQuality.VERY_HIGH:
+            return "320k"
+        return "160k"
+
+    def convert_audio_file(self, source_path: Path, output_path: Path, header=None) -> None:
+        """Converts a raw audio file (ogg vorbis) to user specified format"""
+        with metrics.timer("transcode"):
+            transcode_file(
+                source_path, output_path, self.format, self.bitrate_for(self.quality), header
+            )
+
+    @staticmethod
+    def determine_file_extension_from_path(audio_path: Path) -> str:
+        """Get MIME type from the first bytes of a file"""
+        with open(audio_path, "rb") as f:
+            return RespotTrackHandler._extension_from_magic_bytes(f.read(16))
 
+    @staticmethod
+    def _extension_from_magic_bytes(magic_bytes: bytes) -> str:
         if magic_bytes.startswith(b'\xFF\xFB') or magic_bytes.startswith(b'\xFF\xFA'):
             return 'mp3'
         elif b'RIFF' in magic_bytes and b'WAVE' in magic_bytes:
@@ -675,117 +1135,115 @@ class RespotTrackHandler:
             raise ValueError("The audio stream is malformed.")
 
 
-class RespotUtils:
-    @staticmethod
-    def parse_url(search_input) -> dict:
-        """Determines type of audio from url"""
-        pattern = r"intl-[^/]+/"
-        search_input = re.sub(pattern, "", search_input)
+class RespotDownloadJournal:
+    """Partial download of one track with a journal of the received bytes.
 
-        track_uri_search = re.search(
-            r"^spotify:track:(?P<TrackID>[0-9a-zA-Z]{22})$", search_input
-        )
-        track_url_search = re.search(
-            r"^(https?://)?open\.spotify\.com/track/(?P<TrackID>[0-9a-zA-Z]{22})(\?si=.+?)?$",
-            search_input,
-        )
+    The journal stores the stream offsets already written to the .part file
+    as [start, end] ranges. It is rewritten every RECORD_EVERY bytes, after
+    the data it describes has been flushed, so it never claims bytes the
+    .part file does not have.
+    """
 
-        album_uri_search = re.search(
-            r"^spotify:album:(?P<AlbumID>[0-9a-zA-Z]{22})$", search_input
-        )
-        album_url_search = re.search(
-            r"^(https?://)?open\.spotify\.com/album/(?P<AlbumID>[0-9a-zA-Z]{22})(\?si=.+?)?$",
-            search_input,
-        )
+    RECORD_EVERY = 1024 * 1024
 
-        playlist_uri_search = re.search(
-            r"^spotify:playlist:(?P<PlaylistID>[0-9a-zA-Z]{22})$", search_input
-        )
-        playlist_url_search = re.search(
-            r"^(https?://)?open\.spotify\.com/playlist/(?P<PlaylistID>[0-9a-zA-Z]{22})(\?si=.+?)?$",
-            search_input,
-        )
+    def __init__(self, directory: Path, track_id, quality):
+        quality_name = getattr(quality, "name", quality)
+        self.directory = directory
+        self.part_path = directory / f"{track_id}.{quality_name}.part"
+        self.journal_path = directory / f"{track_id}.{quality_name}.part.json"
+        self.total_size = None
+        self.ranges = []
+        self.recorded_at = 0
 
-        episode_uri_search = re.search(
-            r"^spotify:episode:(?P<EpisodeID>[0-9a-zA-Z]{22})$", search_input
-        )
-        episode_url_search = re.search(
-            r"^(https?://)?open\.spotify\.com/episode/(?P<EpisodeID>[0-9a-zA-Z]{22})(\?si=.+?)?$",
-            search_input,
-        )
+    def resume(self, total_size, start) -> int:
+        """Returns the stream offset to continue from, resetting stale partials"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.total_size = total_size
 
-        show_uri_search = re.search(
-            r"^spotify:show:(?P<ShowID>[0-9a-zA-Z]{22})$", search_input
-        )
-        show_url_search = re.search(
-            r"^(https?://)?open\.spotify\.com/show/(?P<ShowID>[0-9a-zA-Z]{22})(\?si=.+?)?$",
-            search_input,
+        try:
+            journal = json.loads(self.journal_path.read_text())
+            (first_start, end), *_ = journal["ranges"]
+            valid = (
+                journal["total_size"] == total_size
+                and first_start == start
+                and self.part_path.stat().st_size >= end - start
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            valid = False
+
+        if not valid:
+            end = start
+        # Drop bytes written after the last journal entry, they may be incomplete
+        with open(self.part_path, "ab") as part:
+            part.truncate(end - start)
+
+        self.ranges = [[start, end]]
+        self.recorded_at = end
+        self._write()
+        return end
+
+    def record(self, output, end) -> None:
+        if end - self.recorded_at < self.RECORD_EVERY and end < self.total_size:
+            return
+        output.flush()
+        self.ranges[-1][1] = end
+        self.recorded_at = end
+        self._write()
+
+    def _write(self) -> None:
+        part_path = self.journal_path.with_name(self.journal_path.name + ".tmp")
+        part_path.write_text(
+            json.dumps({"total_size": self.total_size, "ranges": self.ranges})
         )
+        os.replace(part_path, self.journal_path)
 
-        artist_uri_search = re.search(
-            r"^spotify:artist:(?P<ArtistID>[0-9a-zA-Z]{22})$", search_input
-        )
-        artist_url_search = re.search(
-            r"^(https?://)?open\.spotify\.com/artist/(?P<ArtistID>[0-9a-zA-Z]{22})(\?si=.+?)?$",
-            search_input,
-        )
+    def discard(self) -> None:
+        self.part_path.unlink(missing_ok=True)
+        self.journal_path.unlink(missing_ok=True)
 
-        if track_uri_search is not None or track_url_search is not None:
-            track_id_str = (
-                track_uri_search if track_uri_search is not None else track_url_search
-            ).group("TrackID")
-        else:
-            track_id_str = None
 
-        if album_uri_search is not None or album_url_search is not None:
-            album_id_str = (
-                album_uri_search if album_uri_search is not None else album_url_search
-            ).group("AlbumID")
-        else:
-            album_id_str = None
-
-        if playlist_uri_search is not None or playlist_url_search is not None:
-            playlist_id_str = (
-                playlist_uri_search
-                if playlist_uri_search is not None
-                else playlist_url_search
-            ).group("PlaylistID")
-        else:
-            playlist_id_str = None
-
-        if episode_uri_search is not None or episode_url_search is not None:
-            episode_id_str = (
-                episode_uri_search
-                if episode_uri_search is not None
-                else episode_url_search
-            ).group("EpisodeID")
-        else:
-            episode_id_str = None
+def transcode_file(source_path: Path, output_path: Path, audio_format, bitrate, header=None) -> Path:
+    """Converts an audio file and moves the result into place atomically"""
+    return transcode(source_path, output_path, audio_format, bitrate, header)
 
-        if show_uri_search is not None or show_url_search is not None:
-            show_id_str = (
-                show_uri_search if show_uri_search is not None else show_url_search
-            ).group("ShowID")
-        else:
-            show_id_str = None
-
-        if artist_uri_search is not None or artist_url_search is not None:
-            artist_id_str = (
-                artist_uri_search
-                if artist_uri_search is not None
-                else artist_url_search
-            ).group("ArtistID")
-        else:
-            artist_id_str = None
 
-        return {
-            "track": track_id_str,
-            "album": album_id_str,
-            "playlist": playlist_id_str,
-            "episode": episode_id_str,
-            "show": show_id_str,
-            "artist": artist_id_str,
-        }
+class RespotUtils:
+    URL_TYPES = ("track", "album", "playlist", "episode", "show", "artist")
+
+    # One pass over both forms:
+    #   spotify:track:<id>
+    #   [https://]open.spotify.com[/intl-xx][/embed]/track/<id>[/][?si=...&context=...][#...]
+    URL_PATTERN = re.compile(
+        r"^(?:spotify:(?P<uri_type>track|album|playlist|episode|show|artist):(?P<uri_id>[0-9a-zA-Z]{22})"
+        r"|(?:https?://)?open\.spotify\.com/(?:intl-[^/]+/)?(?:embed/)?"
+        r"(?P<url_type>track|album|playlist|episode|show|artist)/(?P<url_id>[0-9a-zA-Z]{22})"
+        r"/?(?:\?[^#\s]*)?(?:#\S*)?)$"
+    )
+
+    @staticmethod
+    def parse_url(search_input) -> dict:
+        """Determines type of audio from url"""
+        parsed = dict.fromkeys(RespotUtils.URL_TYPES)
+
+        match = RespotUtils.URL_PATTERN.match(search_input.strip())
+        if match:
+            if match.group("uri_type"):
+                parsed[match.group("uri_type")] = match.group("uri_id")
+            else:
+                parsed[match.group("url_type")] = match.group("url_id")
+
+        return parsed
+
+    @staticmethod
+    def parse_urls(search_inputs) -> list:
+        """Parses many urls at once, e.g. the lines of a pasted link list"""
+        if isinstance(search_inputs, str):
+            search_inputs = search_inputs.splitlines()
+        return [
+            RespotUtils.parse_url(search_input)
+            for search_input in search_inputs
+            if search_input.strip()
+        ]
 
     @staticmethod
     def conv_artist_format(artists: list) -> str:
@@ -0,0 +1,204 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+from modules.utils import FileLock
+
+
+class TokenBucket:
+    """Paces downloads with a burst allowance plus a sustained rate.
+
+    Every failed download doubles a pause applied to the whole bucket (up to
+    max_backoff), every successful one halves it again.
+
+    With a state_file the bucket is shared by every process using that
+    file, so one CLI run per track is paced like a long-lived worker.
+    """
+
+    def __init__(self, rate, burst, min_backoff=5, max_backoff=300, state_file=None):
+        """
+        Args:
+            rate (float): Tokens added per second.
+            burst (int): Maximum number of tokens the bucket can hold.
+            state_file (Path): Keeps tokens and backoff between processes, None keeps them in memory.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.state_file = state_file
+        # Shared state outlives the process, so it needs the wall clock
+        self.clock = time.time if state_file else time.monotonic
+
+        self.tokens = float(burst)
+        self.backoff = 0
+        self.paused_until = 0.0
+        self.updated_at = self.clock()
+        self.lock = threading.Lock()
+
+        if self.state_file:
+            self.state_file.parent.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def _state(self):
+        """Holds the bucket, loading and saving the shared state around the block"""
+        with self.lock:
+            if not self.state_file:
+                yield
+                return
+
+            with FileLock(self.state_file.with_suffix(".lock")):
+                self._load()
+                try:
+                    yield
+                finally:
+                    self._save()
+
+    def _load(self) -> None:
+        try:
+            state = json.loads(self.state_file.read_text())
+            self.tokens = float(state["tokens"])
+            self.backoff = state["backoff"]
+            self.paused_until = state["paused_until"]
+            self.updated_at = state["updated_at"]
+        except (OSError, ValueError, KeyError, TypeError):
+            # No state yet, the bucket starts full
+            pass
+
+    def _save(self) -> None:
+        state = {
+            "tokens": self.tokens,
+            "backoff": self.backoff,
+            "paused_until": self.paused_until,
+            "updated_at": self.updated_at,
+        }
+        part_path = self.state_file.with_suffix(".part")
+        part_path.write_text(json.dumps(state))
+        os.replace(part_path, self.state_file)
+
+    def _refill(self, now) -> None:
+        # max() keeps a clock set backwards from draining the bucket
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def acquire(self) -> None:
+        """Blocks until a token is available"""
+        while True:
+            with self._state():
+                now = self.clock()
+                self._refill(now)
+
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def report_success(self) -> None:
+        with self._state():
+            self.backoff = self.backoff // 2 if self.backoff > self.min_backoff else 0
+
+    def report_failure(self) -> None:
+        with self._state():
+            self.backoff = min(max(self.backoff * 2, self.min_backoff), self.max_backoff)
+            self.paused_until = max(self.paused_until, self.clock() + self.backoff)
+
+
+class DownloadScheduler:
+    """Runs up to max_workers downloads at once over a shared session"""
+
+    def __init__(self, worker, max_workers):
+        """
+        Args:
+            worker (callable): Called with the submitted arguments, e.g. Spotify.download_track.
+            max_workers (int): Number of downloads allowed to run at the same time.
+        """
+        self.worker = worker
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="download"
+        )
+
+    def submit(self, *args, **kwargs):
+        return self.executor.submit(self.worker, *args, **kwargs)
+
+    def run(self, *args, **kwargs):
+        """Schedules one download and waits for its result"""
+        return self.submit(*args, **kwargs).result()
+
+    def shutdown(self, wait=True) -> None:
+        self.executor.shutdown(wait=wait)
+
+
+class SingleFlight:
+    """Lets concurrent requests for the same key share one execution.
+
+    The first caller of a key runs it, later callers wait for its result.
+    With a lock_dir the owner also holds a per-key file lock, so separate
+    CLI processes queue up behind each other instead of working in parallel.
+    """
+
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir
+        self.in_flight = {}
+        self.file_locks = {}
+        self.lock = threading.Lock()
+
+        if self.lock_dir:
+            self.lock_dir.mkdir(parents=True, exist_ok=True)
+
+    def begin(self, key):
+        """Returns (future, is_owner), an owner must call end() with the result"""
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self.in_flight[key] = future
+
+        if self.lock_dir:
+            # Removed again on end(), keys are per track and would pile up
+            file_lock = FileLock(self.lock_dir / f"{key}.lock", remove=True)
+            try:
+                file_lock.__enter__()
+            except Exception as e:
+                # Waiting callers would otherwise block on the future forever
+                self.end(key, error=e)
+                raise
+            self.file_locks[key] = file_lock
+
+        return future, True
+
+    def end(self, key, result=None, error=None) -> None:
+        file_lock = self.file_locks.pop(key, None)
+        if file_lock:
+            file_lock.__exit__(None, None, None)
+
+        with self.lock:
+            future = self.in_flight.pop(key)
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run(self, key, func, *args, **kwargs):
+        future, owner = self.begin(key)
+        if not owner:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.end(key, error=e)
+            raise
+        self.end(key, result)
+        return result
@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import socketserver
+import sys
+import threading
+
+
+class SpotifyServer:
+    """Serves Spotify commands as JSON lines over stdin/stdout or TCP.
+
+    Every request is one JSON object per line, e.g.
+    {"id": 1, "command": "info", "url": "https://open.spotify.com/track/..."}
+    and every response is one JSON object per line echoing the same "id".
+    """
+
+    def __init__(self, spotify):
+        self.spotify = spotify
+        self.write_lock = threading.Lock()
+
+    def handle(self, message, emit=None) -> dict:
+        """Dispatches one decoded request to the Spotify instance.
+
+        emit, when given, receives progress events of collection downloads.
+        """
+        command = message.get("command")
+
+        if command == "ping":
+            response = {"status": "success", "message": "pong", "data": ""}
+        elif command == "info":
+            response = self.spotify.info(message.get("url"))
+        elif command == "download":
+            on_status = None
+            if emit:
+                on_status = lambda event: emit(self._tag_response(event, message))
+            response = self.spotify.download(message.get("url"), on_status)
+        elif command == "get":
+            response = self.spotify.get(message.get("url"), message.get("rendition"))
+        elif command == "delete":
+            response = self.spotify.delete(message.get("filename"))
+        elif command == "stats":
+            response = self.spotify.stats()
+        elif command == "metrics":
+            response = {"status": "success", "message": "", "data": self.spotify.metrics_text()}
+        else:
+            response = {"status": "error", "message": f"Unknown command: {command}", "data": ""}
+
+        return self._tag_response(response, message)
+
+    @staticmethod
+    def _tag_response(response, message) -> dict:
+        if "id" in message:
+            response["id"] = message["id"]
+        return response
+
+    def handle_line(self, line, emit=None) -> str:
+        try:
+            message = json.loads(line)
+            if not isinstance(message, dict):
+                raise ValueError("Request must be a JSON object")
+            response = self.handle(message, emit)
+        except Exception as e:
+            response = {"status": "error", "message": str(e), "data": ""}
+        return json.dumps(response)
+
+    def start(self) -> bool:
+        """Authenticates and migrates the archive once for the whole session"""
+        if not self.spotify.authenticate():
+            return False
+        self.spotify.migrate_archive()
+        return True
+
+    def serve_stdio(self, stdin=None, stdout=None, max_workers=8) -> None:
+        """Handles lines concurrently, responses carry the "id" of their request"""
+        stdin = stdin or sys.stdin
+        stdout = stdout or sys.stdout
+
+        def write(response):
+            with self.write_lock:
+                stdout.write(response + "\n")
+                stdout.flush()
+
+        if not self.start():
+            write(json.dumps({"status": "error", "message": "Unauthenticated", "data": ""}))
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for line in stdin:
+                if not line.strip():
+                    continue
+                emit = lambda event: write(json.dumps(event))
+                executor.submit(lambda line=line: write(self.handle_line(line, emit)))
+
+    def serve_unix(self, path) -> None:
+        """Listens on a Unix socket only its owner can open, unlike a local TCP port"""
+        if not self.start():
+            print(json.dumps({"status": "error", "message": "Unauthenticated", "data": ""}))
+            return
+
+        if os.path.exists(path):
+            os.remove(path)
+        # Created without any group or other permission, then opened up to the owner
+        umask = os.umask(0o177)
+        try:
+            unix_server = socketserver.ThreadingUnixStreamServer(path, self._stream_handler())
+        finally:
+            os.umask(umask)
+
+        with unix_server:
+            unix_server.daemon_threads = True
+            try:
+                unix_server.serve_forever()
+            finally:
+                os.remove(path)
+
+    def serve_tcp(self, host="127.0.0.1", port=8765) -> None:
+        """Any local user can connect, prefer serve_unix where Unix sockets exist"""
+        if not self.start():
+            print(json.dumps({"status": "error", "message": "Unauthenticated", "data": ""}))
+            return
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        with socketserver.ThreadingTCPServer((host, port), self._stream_handler()) as tcp_server:
+            tcp_server.daemon_threads = True
+            tcp_server.serve_forever()
+
+    def _stream_handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                self.write_lock = threading.Lock()
+
+            def write(self, response):
+                with self.write_lock:
+                    self.wfile.write((response + "\n").encode("utf-8"))
+                    self.wfile.flush()
+
+            def handle(self):
+                emit = lambda event: self.write(json.dumps(event))
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    self.write(server.handle_line(line.decode("utf-8"), emit))
+
+        return Handler
@@ -1,11 +1,20 @@
+from io import BytesIO
+
 import music_tag
-import requests
 from mutagen import id3
 
+from modules.cache import ArtworkCache
+
 class AudioTagger:
     
-    def __init__(self):
-        pass
+    def __init__(self, artwork_cache=None, artwork_size=None):
+        """
+        Args:
+            artwork_size (int): Covers are downscaled to fit artwork_size x artwork_size before
+                they are embedded, None embeds them as served.
+        """
+        self.artwork_cache = artwork_cache or ArtworkCache()
+        self.artwork_size = artwork_size
 
     def set_audio_tags(self, fullpath, artists=None, name=None, album_name=None, release_year=None,
                        disc_number=None, track_number=None, track_id_str=None, album_artist=None, image_url=None):
@@ -22,10 +31,33 @@ class AudioTagger:
             self._set_other_tags(fullpath, artists, name, album_name, release_year, disc_number,
                                  track_number, track_id_str, image_url)
 
+    def build_mp3_tags(self, artists=None, name=None, album_name=None, release_year=None,
+                       disc_number=None, track_number=None, track_id_str=None, album_artist=None, image_url=None) -> bytes:
+        """Returns a complete ID3v2 block, artwork included, to write ahead of the mp3 audio.
+
+        A file that starts with it needs no tagging afterwards, so the audio
+        is never rewritten to make room for the header.
+        """
+        album_artist = album_artist or artists
+
+        tags = id3.ID3()
+        self._add_mp3_frames(tags, artists, name, album_name, release_year, disc_number,
+                             track_number, track_id_str, album_artist, image_url)
+
+        header = BytesIO()
+        # Default padding leaves room for later edits without moving the audio
+        tags.save(header, v1=0)
+        return header.getvalue()
+
     def _set_mp3_tags(self, fullpath, artist, name, album_name, release_year, disc_number, 
                       track_number, track_id_str, album_artist, image_url):
         tags = id3.ID3(fullpath)
+        self._add_mp3_frames(tags, artist, name, album_name, release_year, disc_number,
+                             track_number, track_id_str, album_artist, image_url)
+        tags.save()
 
+    def _add_mp3_frames(self, tags, artist, name, album_name, release_year, disc_number,
+                        track_number, track_id_str, album_artist, image_url):
         mp3_map = {
             "TPE1": artist,
             "TIT2": name,
@@ -43,12 +75,10 @@ class AudioTagger:
                 tags[tag] = id3.Frames[tag](encoding=3, text=value)
 
         if image_url:
-            albumart = requests.get(image_url).content
+            albumart = self.artwork_cache.get(image_url, self.artwork_size)
             if albumart:
                 tags["APIC"] = id3.APIC(encoding=3, mime="image/jpeg", type=3, desc="0", data=albumart)
 
-        tags.save()
-
     def _set_other_tags(self, fullpath, artist, name, album_name, release_year, disc_number, 
                         track_number, track_id_str, image_url):
         tags = music_tag.load_file(fullpath)
@@ -68,7 +98,7 @@ class AudioTagger:
                 tags[tag] = value
 
         if image_url:
-            albumart = requests.get(image_url).content
+            albumart = self.artwork_cache.get(image_url, self.artwork_size)
             if albumart:
                 tags["artwork"] = albumart
 
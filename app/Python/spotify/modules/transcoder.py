@@ -0,0 +1,153 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+FFMPEG = shutil.which("ffmpeg") or "ffmpeg"
+CHUNK_SIZE = 64 * 1024
+
+CODECS = {
+    "mp3": "libmp3lame",
+    "ogg": "libvorbis",
+    "flac": "flac",
+    "wav": "pcm_s16le",
+}
+
+
+def transcode(source, output_path: Path, audio_format, bitrate=None, header=None) -> Path:
+    """Transcodes with an ffmpeg subprocess, without decoding to PCM in Python.
+
+    Args:
+        source (Path | file object): Input file, or a readable object piped to ffmpeg's stdin.
+        output_path (Path): Final location, written through a .part file and renamed.
+        audio_format (str): Output container, e.g. "mp3".
+        bitrate (str): Output bitrate, e.g. "320k".
+        header (bytes): mp3 only, a complete ID3v2 block written ahead of the audio.
+    """
+    part_path = output_path.with_name(f".{output_path.name}.part")
+    piped = not isinstance(source, (str, os.PathLike))
+
+    command = [FFMPEG, "-hide_banner", "-loglevel", "error", "-y"]
+    if not piped:
+        command.append("-nostdin")
+    command += ["-i", "pipe:0" if piped else str(source), "-vn", "-map_metadata", "-1"]
+    if audio_format in CODECS:
+        command += ["-codec:a", CODECS[audio_format]]
+    if bitrate and audio_format not in ("flac", "wav"):
+        command += ["-b:a", bitrate]
+    if header:
+        # The audio is streamed after our own tag block. A streamed mp3 gets
+        # no Xing frame, which constant bitrate files do not need for seeking
+        command += ["-id3v2_version", "0", "-write_xing", "0", "-f", audio_format, "pipe:1"]
+    else:
+        command += ["-f", audio_format, str(part_path)]
+
+    output = None
+    try:
+        if header:
+            output = open(part_path, "wb")
+            output.write(header)
+            output.flush()
+
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE if piped else subprocess.DEVNULL,
+                stdout=output or subprocess.DEVNULL,
+                stderr=errors,
+            )
+            if piped:
+                try:
+                    while chunk := source.read(CHUNK_SIZE):
+                        process.stdin.write(chunk)
+                except BrokenPipeError:
+                    # ffmpeg stopped reading, its exit code tells why
+                    pass
+                finally:
+                    process.stdin.close()
+
+            if process.wait() != 0:
+                errors.seek(0)
+                message = errors.read().decode("utf-8", "replace").strip()
+                raise RuntimeError(f"ffmpeg failed: {message}")
+
+        if output:
+            output.close()
+        os.replace(part_path, output_path)
+    finally:
+        if output:
+            output.close()
+        part_path.unlink(missing_ok=True)
+
+    return output_path
+
+
+def parse_rendition(spec) -> tuple:
+    """Returns (audio_format, bitrate) from "mp3:128k", bitrate is None for "ogg" """
+    audio_format, _, bitrate = spec.strip().lower().partition(":")
+    if audio_format not in CODECS:
+        raise ValueError(f"Unsupported rendition format: {audio_format}")
+    return (audio_format, bitrate or None)
+
+
+def rendition_name(rendition) -> str:
+    audio_format, bitrate = rendition
+    return f"{audio_format}:{bitrate}" if bitrate else audio_format
+
+
+def copy_file(source_path: Path, output_path: Path) -> Path:
+    part_path = output_path.with_name(f".{output_path.name}.part")
+    try:
+        shutil.copyfile(source_path, part_path)
+        os.replace(part_path, output_path)
+    finally:
+        part_path.unlink(missing_ok=True)
+    return output_path
+
+
+class RenditionTranscoder:
+    """Renders several (format, bitrate) renditions of one source in parallel.
+
+    Every rendition is a separate ffmpeg run, started from a thread pool sized
+    to the cpu count. The threads only wait on their ffmpeg process, so they
+    need no worker processes of their own. A rendition in the source's own
+    format without a bitrate is copied instead of transcoded.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def render(self, source_path: Path, targets: dict, headers=None) -> tuple:
+        """Returns ({rendition: path}, {rendition: error message}).
+
+        Args:
+            source_path (Path): Downloaded audio, left in place.
+            targets (dict): {(audio_format, bitrate): output path}.
+            headers (dict): {(audio_format, bitrate): tag block} for renditions tagged while written.
+        """
+        source_format = source_path.suffix[1:]
+        headers = headers or {}
+        futures = {}
+        for (audio_format, bitrate), output_path in targets.items():
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            if audio_format == source_format and bitrate is None:
+                func, func_args = copy_file, (source_path, output_path)
+            else:
+                header = headers.get((audio_format, bitrate))
+                func, func_args = transcode, (source_path, output_path, audio_format, bitrate, header)
+            futures[(audio_format, bitrate)] = self.pool.submit(func, *func_args)
+
+        outputs, errors = {}, {}
+        for rendition, future in futures.items():
+            try:
+                outputs[rendition] = future.result()
+            except Exception as e:
+                errors[rendition] = str(e)
+        return outputs, errors
+
+    def shutdown(self, wait=True) -> None:
+        self.pool.shutdown(wait=wait)
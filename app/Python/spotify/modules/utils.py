@@ -1,54 +1,206 @@
 import os
 import json
 import datetime
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """Exclusive lock shared by every process using the same lock file"""
+
+    def __init__(self, file, remove=False):
+        """
+        Args:
+            remove (bool): Deletes the lock file on release, for locks on short lived keys.
+        """
+        self.file = file
+        self.remove = remove
+        self.handle = None
+
+    def __enter__(self):
+        while True:
+            self.handle = open(self.file, "a+")
+            try:
+                if fcntl:
+                    fcntl.flock(self.handle.fileno(), fcntl.LOCK_EX)
+                else:
+                    # Gives up with an OSError after about 10 seconds
+                    self.handle.seek(0)
+                    msvcrt.locking(self.handle.fileno(), msvcrt.LK_LOCK, 1)
+            except Exception:
+                self.handle.close()
+                self.handle = None
+                raise
+            if not self.remove or self._is_current():
+                return self
+            # The previous owner removed the file while we waited, lock the new one
+            self._unlock()
+
+    def _is_current(self) -> bool:
+        try:
+            return os.path.samestat(os.fstat(self.handle.fileno()), os.stat(self.file))
+        except OSError:
+            return False
+
+    def __exit__(self, *exc):
+        if self.remove:
+            try:
+                os.remove(self.file)
+            except OSError:
+                # Windows cannot remove a file that is still open
+                pass
+        self._unlock()
+
+    def _unlock(self) -> None:
+        if fcntl:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+        else:
+            self.handle.seek(0)
+            msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+        self.handle.close()
+        self.handle = None
 
 
 class Archive:
+    """Downloaded tracks archive.
+
+    archive.json holds a snapshot and every change is appended to
+    archive.jsonl, so an add costs one short write however large the
+    archive grows. The log is folded back into the snapshot every
+    COMPACT_EVERY changes.
+    """
+
+    COMPACT_EVERY = 1000
 
     def __init__(self, file):
         self.file = file
+        self.log_file = file.with_suffix(".jsonl")
+        self.lock_file = file.with_suffix(".lock")
+        self.lock = threading.RLock()
+        self.log_offset = 0
+        self.log_entries = 0
+        self.snapshot_version = None
         self.data = self.load()
 
     def load(self):
+        self.data = {}
+        self.log_offset = 0
+        self.log_entries = 0
+        self.snapshot_version = self._snapshot_version()
         if self.file.exists():
             with open(self.file, "r") as f:
                 try:
-                    return json.load(f)
+                    self.data = json.load(f)
                 except json.JSONDecodeError as e:
                     # print(f"Error loading archive: {e}")
-                    return {}
-        return {}
+                    self.data = {}
+        self._replay()
+        return self.data
+
+    def _replay(self):
+        """Applies log lines written since the last replay, also by other processes"""
+        with self.lock:
+            try:
+                size = self.log_file.stat().st_size
+            except FileNotFoundError:
+                size = 0
+
+            if size < self.log_offset or self._snapshot_version() != self.snapshot_version:
+                # Another process compacted the archive, start over from its snapshot
+                self.load()
+                return
+            if size == self.log_offset:
+                return
+
+            with open(self.log_file, "rb") as f:
+                f.seek(self.log_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Half written line, read it again on the next replay
+                        break
+                    self.log_offset += len(line)
+                    self.log_entries += 1
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record.get("op") == "remove":
+                        self.data.pop(record["id"], None)
+                    else:
+                        self.data[record["id"]] = record["entry"]
+
+    def _snapshot_version(self):
+        try:
+            stat = self.file.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _append(self, record):
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with self.lock, FileLock(self.lock_file):
+            self._replay()
+            with open(self.log_file, "ab") as f:
+                f.write(line)
+            self._replay()
+            if self.log_entries >= self.COMPACT_EVERY:
+                self._compact()
+
+    def _compact(self):
+        """Writes the full snapshot and empties the log, caller holds the locks"""
+        temp_file = self.file.with_suffix(".json.tmp")
+        with open(temp_file, "w") as f:
+            json.dump(self.data, f)
+        os.replace(temp_file, self.file)
+        open(self.log_file, "wb").close()
+        self.log_offset = 0
+        self.log_entries = 0
+        self.snapshot_version = self._snapshot_version()
 
     def save(self):
-        with open(self.file, "w") as f:
-            json.dump(self.data, f, indent=4)
+        with self.lock, FileLock(self.lock_file):
+            pending = dict(self.data)
+            self._replay()
+            self.data.update(pending)
+            self._compact()
 
     def add(self, track_id, artist=None, track_name=None, fullpath=None,
             audio_type=None, timestamp=None, save=True):
         if not timestamp:
             timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.data[track_id] = {
+        entry = {
             "artist": artist,
             "track_name": track_name,
             "audio_type": audio_type,
             "fullpath": str(fullpath),
             "timestamp": timestamp
         }
-        # print(f"Added to archive: {artist} - {track_name}")
-        if save:
-            self.save()
+        with self.lock:
+            self.data[track_id] = entry
+            # print(f"Added to archive: {artist} - {track_name}")
+            if save:
+                self._append({"op": "add", "id": track_id, "entry": entry})
 
     def get(self, track_id):
+        self._replay()
         return self.data.get(track_id)
 
     def remove(self, track_id):
-        self.data.pop(track_id)
-        self.save()
+        with self.lock:
+            self.data.pop(track_id)
+            self._append({"op": "remove", "id": track_id})
 
     def exists(self, track_id):
+        self._replay()
         return track_id in self.data
 
     def get_all(self):
+        self._replay()
         return self.data
 
     def get_ids_from_old_archive(self, old_archive_file):
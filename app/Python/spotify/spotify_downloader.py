@@ -1,32 +1,69 @@
-from modules.respot import Respot, RespotUtils
+from modules.respot import Respot, RespotTrackHandler, RespotUtils
 from pathlib import Path
 from getpass import getpass
 from modules.utils import Archive
 from modules.tagger import AudioTagger
-import argparse, json, os
+from modules.server import SpotifyServer
+from modules.scheduler import DownloadScheduler, SingleFlight, TokenBucket
+from modules.cache import ArtworkCache, DownloadCache, MetadataCache
+from modules.pipeline import DownloadPipeline
+from modules.metrics import metrics, serve_metrics
+from modules.transcoder import RenditionTranscoder, parse_rendition, rendition_name
+import argparse, json, os, threading
 
 
 CONFIG_DIR   = f"{os.path.dirname(__file__)}\configs"
-TEMP_DIR     = f"{os.path.dirname(__file__)}\temp"
+TEMP_DIR     = f"{os.path.dirname(__file__)}\\temp"
 DOWNLOAD_DIR = f"{os.path.dirname(__file__)}\..\..\..\storage\app\public\downloads"
 
 ANTI_BAN_WAIT_TIME = 5
 ANTI_BAN_WAIT_TIME_ALBUMS = 30
+ANTI_BAN_RATE = 1 / ANTI_BAN_WAIT_TIME
+ANTI_BAN_BURST = 3
+DOWNLOAD_WORKERS = 4
+METADATA_CACHE_TTL = 7 * 24 * 60 * 60
+METADATA_CACHE_MAX_ENTRIES = 50000
+DOWNLOAD_CACHE_MAX_BYTES = 10 * 1024 * 1024 * 1024
+ARTWORK_SIZE = 500
+ARTWORK_QUALITY = 85
 LIMIT_RESULTS = 10
 
 
+def jpeg_quality(value):
+    """argparse type for --artwork-quality, Pillow accepts 1 to 95"""
+    quality = int(value)
+    if not 1 <= quality <= 95:
+        raise argparse.ArgumentTypeError("must be between 1 and 95")
+    return quality
+
+
 class Spotify:
     def __init__(self):
         self.SEPARATORS = [",", ";"]
         self.args = self.parse_args()
         self.audio_format = "mp3"
 
+        # The bucket state lives in configs/, so one process per track is still paced
+        self.limiter = self.create_limiter(Path(CONFIG_DIR) / "antiban.json")
+        self.metadata_cache = MetadataCache(
+            Path(CONFIG_DIR) / "metadata.db",
+            ttl=METADATA_CACHE_TTL,
+            max_entries=METADATA_CACHE_MAX_ENTRIES,
+        )
         self.respot = Respot(
             config_dir=CONFIG_DIR,
             force_premium=False,
             credentials=Path(CONFIG_DIR) / "credentials.json",
             audio_format=self.audio_format,
             antiban_wait_time=ANTI_BAN_WAIT_TIME,
+            limiter=self.limiter,
+            metadata_cache=self.metadata_cache,
+            # Every extra account gets its own anti-ban budget
+            extra_credentials=sorted(Path(CONFIG_DIR).glob("credentials-*.json")),
+            limiter_factory=lambda credentials: self.create_limiter(
+                Path(CONFIG_DIR) / f"antiban-{credentials.stem}.json"
+            ),
+            partial_dir=Path(TEMP_DIR) / "partial",
         )
 
         self.search_limit = LIMIT_RESULTS
@@ -34,14 +71,44 @@ class Spotify:
         self.config_dir = Path(CONFIG_DIR)
         self.download_dir = Path(TEMP_DIR)
         self.music_dir = Path(DOWNLOAD_DIR)
+        self.episodes_dir = Path(DOWNLOAD_DIR)
 
         self.album_in_filename = False
         self.antiban_album_time = ANTI_BAN_WAIT_TIME_ALBUMS
-        self.not_skip_existing = True
-        self.skip_downloaded = False
+        self.not_skip_existing = False
+        self.skip_downloaded = True
         self.archive_file = self.config_dir / "archive.json"
         self.archive = Archive(self.archive_file)
-        self.tagger = AudioTagger()
+        self.download_cache = DownloadCache(
+            self.config_dir / "downloads.db", max_bytes=DOWNLOAD_CACHE_MAX_BYTES
+        )
+        self.artwork_cache = ArtworkCache(
+            self.config_dir / "artwork",
+            quality=self.args.artwork_quality or ARTWORK_QUALITY,
+        )
+        # 0 embeds the covers as Spotify serves them
+        artwork_size = ARTWORK_SIZE if self.args.artwork_size is None else self.args.artwork_size
+        self.tagger = AudioTagger(self.artwork_cache, artwork_size or None)
+        self.scheduler = DownloadScheduler(self.download_track, DOWNLOAD_WORKERS)
+        # The worker shares one process, separate CLI runs coordinate through lock files
+        self.flights = SingleFlight(None if self.args.serve else self.config_dir / "locks")
+        self._pipeline = None
+        # Single tracks come from several scheduler threads at once
+        self._init_lock = threading.Lock()
+
+        # Extra (format, bitrate) outputs rendered from the same download,
+        # the source audio is then kept so new renditions never refetch it
+        self.renditions = [
+            parse_rendition(spec) for spec in (self.args.renditions or "").split(",") if spec.strip()
+        ]
+        self.sources_dir = Path(TEMP_DIR) / "sources"
+        self._transcoder = None
+        # Lazy mode only stores the source, get() converts it on first request
+        self.lazy = self.args.lazy
+
+    @staticmethod
+    def create_limiter(state_file):
+        return TokenBucket(rate=ANTI_BAN_RATE, burst=ANTI_BAN_BURST, state_file=state_file)
 
     def parse_args(self):
         parser = argparse.ArgumentParser()
@@ -49,7 +116,7 @@ class Spotify:
             "-l", "--login", help="Login to spotify account"
         )
         parser.add_argument(
-            "-tr", "--track", help="Downloads a track from their id or url"
+            "-tr", "--track", help="Downloads a track, album, playlist, artist or show from its url"
         )
         parser.add_argument(
             "-i", "--info", help="Url containing track"
@@ -57,6 +124,36 @@ class Spotify:
         parser.add_argument(
             "-d", "--delete", help="Delete existing track"
         )
+        parser.add_argument(
+            "-s", "--serve", action="store_true", help="Run as a long-lived worker"
+        )
+        parser.add_argument(
+            "-p", "--port", type=int, help="Serve on 127.0.0.1:PORT instead of stdin/stdout"
+        )
+        parser.add_argument(
+            "--socket", help="Serve on a Unix socket at this path, only its owner can connect"
+        )
+        parser.add_argument(
+            "-m", "--metrics-port", type=int, help="Serve Prometheus metrics on 127.0.0.1:PORT/metrics"
+        )
+        parser.add_argument(
+            "-r", "--renditions", help="Extra outputs rendered from one download, e.g. mp3:128k,ogg"
+        )
+        parser.add_argument(
+            "--lazy", action="store_true", help="Only store the source audio, convert it on first --get"
+        )
+        parser.add_argument(
+            "-g", "--get", help="Returns a track in --rendition, converting its stored source on first request"
+        )
+        parser.add_argument(
+            "--rendition", help="Rendition returned by --get, e.g. mp3:128k, defaults to the main mp3"
+        )
+        parser.add_argument(
+            "--artwork-size", type=int, help=f"Longest side of embedded covers in pixels, 0 keeps them as served (default {ARTWORK_SIZE})"
+        )
+        parser.add_argument(
+            "--artwork-quality", type=jpeg_quality, help=f"JPEG quality of resized covers (default {ARTWORK_QUALITY})"
+        )
         return parser.parse_args()
     
     def login(self):
@@ -67,70 +164,342 @@ class Spotify:
                 return True
         return True
     
-    def download_by_url(self, url):
+    def download_by_url(self, url, on_status=None):
         parsed_url = RespotUtils.parse_url(url)
         if parsed_url["track"]:
-            ret = self.download_track(parsed_url["track"])
+            ret = self.scheduler.run(parsed_url["track"])
+        elif parsed_url["episode"]:
+            ret = self.scheduler.run(parsed_url["episode"], caller="episode")
+        elif parsed_url["album"]:
+            ret = self.download_album(parsed_url["album"], on_status)
+        elif parsed_url["playlist"]:
+            ret = self.download_playlist(parsed_url["playlist"], on_status)
+        elif parsed_url["artist"]:
+            ret = self.download_artist(parsed_url["artist"], on_status)
+        elif parsed_url["show"]:
+            ret = self.download_show(parsed_url["show"], on_status)
         else:
             return { "status": "download-error", "message": "Invalid provided url." }
         return ret
-        
+
+    def download_album(self, album_id, on_status=None):
+        songs = self.respot.request.get_album_songs(album_id)
+        return self.download_collection([song["id"] for song in songs], "album", on_status)
+
+    def download_playlist(self, playlist_id, on_status=None):
+        songs = self.respot.request.get_playlist_songs(playlist_id)
+        return self.download_collection([song["id"] for song in songs], "playlist", on_status)
+
+    def download_artist(self, artist_id, on_status=None):
+        track_ids = []
+        for album in self.respot.request.get_artist_albums(artist_id):
+            track_ids += [song["id"] for song in self.respot.request.get_album_songs(album["id"])]
+        return self.download_collection(track_ids, "album", on_status)
+
+    def download_show(self, show_id, on_status=None):
+        episodes = self.respot.request.get_show_episodes(show_id)
+        return self.download_collection([episode["id"] for episode in episodes], "show", on_status)
+
+    def download_collection(self, track_ids, caller, on_status=None):
+        """Downloads every track not in the archive yet, reporting progress per track"""
+        # Local files and unavailable tracks have no id
+        track_ids = list(dict.fromkeys(i for i in track_ids if i))
+
+        results = {}
+        pending = []
+        for track_id in track_ids:
+            entry = self.archive.get(track_id) if self.skip_downloaded else None
+            if entry and os.path.isfile(entry["fullpath"]):
+                results[track_id] = {
+                    "status": "download-skipped",
+                    "message": "Already downloaded",
+                    "data": {"path": entry["fullpath"]},
+                }
+                self._emit_progress(on_status, track_id, "skipped")
+            else:
+                pending.append(track_id)
+
+        # One request per 50 tracks fills the metadata cache for every job
+        if caller not in ("show", "episode"):
+            with metrics.timer("metadata"):
+                self.respot.request.get_tracks_info(pending)
+
+        progress = None
+        if on_status:
+            progress = lambda job: self._emit_progress(on_status, job.track_id, job.status, job.result)
+
+        results.update(zip(pending, self.download_tracks(pending, caller=caller, on_status=progress)))
+
+        tracks = []
+        for track_id in track_ids:
+            result = results[track_id]
+            data = result.get("data")
+            tracks.append({
+                "track_id": track_id,
+                "status": result.get("status"),
+                "message": result.get("message"),
+                "path": data.get("path") if isinstance(data, dict) else None,
+            })
+
+        downloaded = sum(1 for track in tracks if track["status"] in ("download-success", "download-skipped", "source-stored"))
+        return {
+            "status": "download-success" if downloaded else "download-error",
+            "message": f"Downloaded {downloaded} of {len(tracks)} tracks",
+            "data": {"tracks": tracks},
+        }
+
+    @staticmethod
+    def _emit_progress(on_status, track_id, stage, result=None):
+        if not on_status:
+            return
+        event = {"status": "download-progress", "track_id": track_id, "stage": stage}
+        if result:
+            event["message"] = result.get("message")
+        on_status(event)
+
     def download_track(self, track_id, path=None, caller=None):
-        track = self.respot.request.get_track_info(track_id)
+        """Downloads a track as a one job pipeline run.
+
+        The pipeline also coalesces concurrent calls for the same track.
+        """
+        return self.pipeline.submit(track_id, path, caller).wait()
+
+    @property
+    def pipeline(self):
+        """Download/transcode/tag pipeline, started on first use"""
+        with self._init_lock:
+            if self._pipeline is None:
+                self._pipeline = DownloadPipeline(self, download_workers=DOWNLOAD_WORKERS)
+        return self._pipeline
+
+    @property
+    def transcoder(self):
+        """Rendition transcoder shared by the pipeline threads, started on first use"""
+        with self._init_lock:
+            if self._transcoder is None:
+                self._transcoder = RenditionTranscoder()
+        return self._transcoder
+
+    @property
+    def primary_rendition(self):
+        return self.primary_rendition_for(self.respot.auth.quality)
+
+    def primary_rendition_for(self, quality):
+        """Returns the primary rendition of a source streamed at the given quality"""
+        # Spotify streams Ogg Vorbis, an ogg output is the source itself
+        if self.audio_format == "ogg":
+            return (self.audio_format, None)
+        return (self.audio_format, RespotTrackHandler.bitrate_for(quality))
+
+    def _rendition_key(self, rendition, quality=None):
+        """Returns the (audio_format, quality) a rendition is indexed under in the download cache"""
+        quality = quality or self.respot.auth.quality
+        audio_format, bitrate = rendition
+        if rendition == self.primary_rendition_for(quality):
+            return (audio_format, quality)
+        return (audio_format, bitrate or "source")
+
+    def cached_renditions(self, track_id, extra=(), quality=None):
+        """Returns {"mp3:128k": path or None} for the primary and every extra rendition"""
+        primary = self.primary_rendition_for(quality or self.respot.auth.quality)
+        return {
+            rendition_name(rendition): self.download_cache.get(track_id, *self._rendition_key(rendition, quality))
+            for rendition in dict.fromkeys([primary, *self.renditions, *extra])
+        }
+
+    def fetch_source(self, track_id):
+        """Returns (path, quality) of the kept source audio of a track, downloading it only once"""
+        return self.flights.run(track_id + "-source", self._fetch_source, track_id)
+
+    def _fetch_source(self, track_id):
+        quality = self.respot.auth.quality
+        cached = self.download_cache.get(track_id, "source", quality)
+        if cached:
+            return Path(cached), quality
+
+        # A pooled account may stream at a lower quality than the primary one
+        source_path, quality = self.respot.download(
+            track_id, self.sources_dir / (track_id + ".source"), "source", True
+        )
+        if source_path:
+            self.download_cache.put(track_id, "source", quality, source_path)
+        return source_path, quality
+
+    @staticmethod
+    def source_result(source_path):
+        if not source_path:
+            return { "status": "download-error", "message": "Failed to download track." }
+        # Not a playable download, callers fetch the mp3 with get()
+        return {"status": "source-stored", "message": "Source stored", "data": {"path": str(source_path)}}
+
+    def rendition_targets(self, track_id, temp_path, renditions=None, quality=None):
+        """Returns {rendition: output path} for every rendition not rendered yet"""
+        primary = self.primary_rendition_for(quality or self.respot.auth.quality)
+        targets = {}
+        if renditions is None:
+            renditions = [primary] + self.renditions
+        for rendition in renditions:
+            if rendition in targets or self.download_cache.get(track_id, *self._rendition_key(rendition, quality)):
+                continue
+            if rendition == primary:
+                targets[rendition] = temp_path
+            else:
+                audio_format, bitrate = rendition
+                suffix = f" [{bitrate}]" if bitrate else ""
+                targets[rendition] = temp_path.with_name(f"{temp_path.stem}{suffix}.{audio_format}")
+        return targets
+
+    def finish_renditions(self, track_id, track, targets, outputs, errors, headers=None, quality=None):
+        """Archives and tags the primary output, tags and indexes the other renditions"""
+        headers = headers or {}
+        quality = quality or self.respot.auth.quality
+        primary = self.primary_rendition_for(quality)
+        if primary in targets:
+            result = self.finish_track(
+                track_id, track, outputs.get(primary), quality, tagged=primary in headers
+            )
+            if result["status"] != "download-success":
+                return result
+        else:
+            path = self.download_cache.get(track_id, *self._rendition_key(primary, quality))
+            result = {"status": "download-success", "message": "Download success", "data": {"path": path}}
+
+        for rendition, output_path in outputs.items():
+            if rendition == primary:
+                continue
+            # A broken extra rendition is reported, the primary download still succeeded
+            try:
+                if rendition not in headers:
+                    with metrics.timer("tag"):
+                        self.tag_track(track, output_path)
+                self.download_cache.put(track_id, *self._rendition_key(rendition, quality), output_path)
+            except Exception as e:
+                errors[rendition] = str(e)
+
+        result["data"]["renditions"] = self.cached_renditions(track_id, targets, quality)
+        if errors:
+            result["data"]["errors"] = {rendition_name(r): message for r, message in errors.items()}
+        return result
+
+    def download_tracks(self, track_ids, path=None, caller=None, on_status=None):
+        """Downloads several tracks through the pipeline, results in input order"""
+        return self.pipeline.run(track_ids, path, caller, on_status)
+
+    def cached_download(self, track_id):
+        """Returns the result of an earlier download in the same format and quality"""
+        if self.not_skip_existing:
+            return None
+
+        path = self.download_cache.get(track_id, self.audio_format, self.respot.auth.quality)
+        if path is None:
+            return None
+
+        data = {"path": path}
+        if self.renditions:
+            data["renditions"] = self.cached_renditions(track_id)
+            if None in data["renditions"].values():
+                return None
+        return {"status": "download-success", "message": "Download success", "data": data}
+
+    def prepare_track(self, track_id, path=None, caller=None):
+        """Fetches metadata and picks the output path, returns (track, path, error)"""
+        with metrics.timer("metadata"):
+            if caller == "show" or caller == "episode":
+                track = self.respot.request.get_episode_info(track_id)
+            else:
+                track = self.respot.request.get_track_info(track_id)
 
         if track is None:
-            return { "status": "download-error", "message": "Track not found." }
+            return None, None, { "status": "download-error", "message": "Track not found." }
 
         if not track["is_playable"]:
-            return { "status": "download-error", "message": "Track is not playable." }
-
-        audio_name   = track.get("audio_name")
-        audio_number = track.get("audio_number")
-        artist_name  = track.get("artist_name")
-        album_artist = track.get("album_artist")
-        album_name   = track.get("album_name")
+            return None, None, { "status": "download-error", "message": "Track is not playable." }
 
         filename = self.generate_filename(
             caller,
-            audio_name,
-            audio_number,
-            artist_name,
-            album_name,
+            track.get("audio_name"),
+            track.get("audio_number"),
+            track.get("artist_name"),
+            track.get("album_name"),
         )
 
         base_path = path or self.music_dir
         if caller == "show" or caller == "episode":
             base_path = path or self.episodes_dir
+        elif caller == "album" and path is None:
+            # Album tracks are only named by number, one folder per album keeps them apart
+            base_path = self.music_dir / RespotUtils.sanitize_data(
+                f"{track.get('album_artist')} - {track.get('album_name')}"
+            ).rstrip(". ")
 
         temp_path = base_path / (filename + "." + self.audio_format)
+        return track, temp_path, None
 
-        output_path = self.respot.download(
-            track_id, temp_path, self.audio_format, True
-        )
+    def finish_track(self, track_id, track, output_path, quality, tagged=False):
+        """Archives and tags a downloaded track, tagged files already carry their tags.
 
-        self.archive.add(
-            track_id,
-            artist=artist_name,
-            track_name=audio_name,
-            fullpath=output_path,
-            audio_type="music",
-        )
+        The file is indexed under the quality it was streamed at, so a lower
+        quality download never answers a request for the primary quality.
+        """
+        if not output_path:
+            return { "status": "download-error", "message": "Failed to download track." }
 
-        self.tagger.set_audio_tags(
-            output_path,
-            artists=artist_name,
-            name=audio_name,
-            album_name=album_name,
-            release_year=track["release_year"],
-            disc_number=track["disc_number"],
-            track_number=audio_number,
-            album_artist=album_artist,
-            track_id_str=track["scraped_song_id"],
-            image_url=track["image_url"],
+        audio_name   = track.get("audio_name")
+        artist_name  = track.get("artist_name")
+
+        with metrics.timer("archive"):
+            self.archive.add(
+                track_id,
+                artist=artist_name,
+                track_name=audio_name,
+                fullpath=output_path,
+                audio_type="episode" if "show_name" in track else "music",
+            )
+
+        if not tagged:
+            with metrics.timer("tag"):
+                self.tag_track(track, output_path)
+
+        self.download_cache.put(
+            track_id, Path(output_path).suffix[1:], quality, output_path
         )
 
         return {"status": "download-success", "message": "Download success", "data": {"path": str(output_path)}} 
 
+    @staticmethod
+    def _tag_fields(track):
+        return {
+            "artists": track.get("artist_name"),
+            "name": track.get("audio_name"),
+            "album_name": track.get("album_name") or track.get("show_name"),
+            "release_year": track["release_year"],
+            "disc_number": track["disc_number"],
+            "track_number": track.get("audio_number"),
+            "album_artist": track.get("album_artist"),
+            "track_id_str": track.get("scraped_song_id"),
+            "image_url": track["image_url"],
+        }
+
+    def tag_track(self, track, output_path):
+        self.tagger.set_audio_tags(output_path, **self._tag_fields(track))
+
+    def tag_header(self, track, audio_format):
+        """Returns the tag block written ahead of the audio, None when the file is tagged afterwards"""
+        # Sources are Ogg, so an mp3 output always goes through ffmpeg
+        if audio_format != "mp3":
+            return None
+        with metrics.timer("tag"):
+            return self.tagger.build_mp3_tags(**self._tag_fields(track))
+
+    def tag_headers(self, track, targets):
+        """Returns {rendition: tag block} for the renditions tagged while they are written"""
+        headers = {}
+        for rendition in targets:
+            header = self.tag_header(track, rendition[0])
+            if header is not None:
+                headers[rendition] = header
+        return headers
+
     def generate_filename(
             self,
             caller,
@@ -187,54 +556,164 @@ class Spotify:
                 return True
         return True
 
-    def start(self):
-        if self.respot.is_authenticated() == False:
-            print(json.dumps({"status": "error", "message": "Unauthenticated", "data": ""}))
-            return
-        
+    def authenticate(self):
+        """Authenticates once and reuses the session on later calls"""
+        if self.respot.request is None:
+            self.respot.is_authenticated()
+        return self.respot.request is not None
+
+    def migrate_archive(self):
         paths_to_check = (
             self.config_dir,
             self.download_dir,
-            self.music_dir
+            self.music_dir,
         )
+        self.archive.archive_migration(paths_to_check)
+
+    def download(self, url, on_status=None):
+        if not self.authenticate():
+            return {"status": "error", "message": "Unauthenticated", "data": ""}
 
         try:
-            self.archive.archive_migration(paths_to_check)
-            print(json.dumps(self.download_by_url(self.args.track)))
+            self.migrate_archive()
+            return self.download_by_url(url, on_status)
         except Exception as e:
-            print(json.dumps({"status": "download-error", "message": str(e), "data": ""}))
+            return {"status": "download-error", "message": str(e), "data": ""}
 
-    def get_info(self):
-        if self.respot.is_authenticated() == False:
-            print(json.dumps({"status": "error", "message": "Unauthenticated", "data": "[]"}))
-            return
-
-        paths_to_check = (
-            self.config_dir,
-            self.download_dir,
-            self.music_dir,
-        )
+    def info(self, url):
+        if not self.authenticate():
+            return {"status": "error", "message": "Unauthenticated", "data": "[]"}
 
-        self.archive.archive_migration(paths_to_check)
+        self.migrate_archive()
 
-        url = self.args.info
         parsed_url = RespotUtils.parse_url(url)
         if parsed_url["track"]:
             track_info = self.respot.request.get_track_info(parsed_url["track"])
             if track_info is None:
-                print(json.dumps({"status": "error", "message": "Cannot get track info", "data": "[]"}))
-                return
-            else:
-                print(json.dumps({"status": "success", "data": track_info, "message": ""}))
-                return
-        else:
-            print(json.dumps({"status": "error", "message": "Invalid url", "data": "[]"}))
-            return
+                return {"status": "error", "message": "Cannot get track info", "data": "[]"}
+            return {"status": "success", "data": track_info, "message": ""}
+        return {"status": "error", "message": "Invalid url", "data": "[]"}
+
+    def get(self, url, rendition=None):
+        """Returns a track in one rendition, converting its stored source on first request"""
+        if not self.authenticate():
+            return {"status": "error", "message": "Unauthenticated", "data": ""}
+
+        parsed_url = RespotUtils.parse_url(url)
+        track_id = parsed_url["track"] or parsed_url["episode"]
+        if not track_id:
+            return {"status": "download-error", "message": "Invalid provided url."}
+
+        try:
+            rendition = parse_rendition(rendition) if rendition else self.primary_rendition
+            audio_format, bitrate = rendition
+            # Concurrent requests for the same rendition share one conversion
+            return self.flights.run(
+                f"{track_id}-{audio_format}-{bitrate or 'source'}",
+                self._render,
+                track_id,
+                rendition,
+                "episode" if parsed_url["episode"] else None,
+            )
+        except Exception as e:
+            return {"status": "download-error", "message": str(e), "data": ""}
+
+    def _render(self, track_id, rendition, caller=None):
+        cached = self.download_cache.get(track_id, *self._rendition_key(rendition))
+        if cached:
+            return {"status": "download-success", "message": "Download success", "data": {"path": cached}}
+
+        track, temp_path, error = self.prepare_track(track_id, caller=caller)
+        if error:
+            return error
+
+        source_path, quality = self.fetch_source(track_id)
+        if not source_path:
+            return { "status": "download-error", "message": "Failed to download track." }
+
+        if rendition == self.primary_rendition:
+            # The source may come from a pooled account with a lower quality
+            rendition = self.primary_rendition_for(quality)
+        targets = self.rendition_targets(track_id, temp_path, [rendition], quality)
+        headers = self.tag_headers(track, targets)
+        with metrics.timer("transcode"):
+            outputs, errors = self.transcoder.render(source_path, targets, headers)
+        if rendition not in outputs:
+            return {"status": "download-error", "message": errors.get(rendition, "Failed to convert track.")}
+
+        result = self.finish_renditions(track_id, track, targets, outputs, errors, headers, quality)
+        if rendition in errors:
+            return {"status": "download-error", "message": errors[rendition]}
+        if result["status"] == "download-success":
+            result["data"]["path"] = str(outputs[rendition])
+        return result
+
+    def delete(self, filename):
+        filepath = self.music_dir / (filename or "")
+        # Only files inside the downloads folder, never "../" or absolute paths
+        music_dir = self.music_dir.resolve()
+        if not filename or music_dir not in filepath.resolve().parents:
+            return {"status": "error-delete", "message": f"Invalid file name {filename}", "data": "[]"}
 
-    def delete_track(self):
-        filename = self.args.delete
-        filepath = self.music_dir / filename
         if os.path.isfile(filepath) and os.path.exists(filepath):
             os.remove(filepath)
+        self.download_cache.remove_path(filepath)
+
+        return {"status": "success-delete", "message": f"Success delete file {filename}", "data": "[]"}
+
+    def stats(self):
+        data = {
+            "metadata_cache": self.metadata_cache.stats(),
+            "artwork_cache": self.artwork_cache.stats(),
+            "download_cache": self.download_cache.stats(),
+            "sessions": self.respot.session_pool.stats() if self.respot.session_pool else [],
+        }
+        return {"status": "success", "message": "", "data": data}
+
+    def metrics_text(self):
+        """Prometheus text exposition of the stage timers, counters and caches"""
+        gauges = {}
+        stats = self.stats()["data"]
+        for cache in ("metadata_cache", "artwork_cache", "download_cache"):
+            labels = (("cache", cache.replace("_cache", "")),)
+            gauges[("cache_entries", labels)] = stats[cache]["size"]
+            gauges[("cache_hits", labels)] = stats[cache]["hits"]
+            gauges[("cache_misses", labels)] = stats[cache]["misses"]
+            gauges[("cache_hit_ratio", labels)] = round(stats[cache]["hit_rate"], 4)
+
+        bytes_per_second = metrics.timings().get("bytes_per_second")
+        if bytes_per_second:
+            gauges[("download_bytes_per_second", ())] = bytes_per_second
+        return metrics.render(gauges)
+
+    def start(self):
+        # Collections print one progress line per track before the final result
+        on_status = lambda event: print(json.dumps(event), flush=True)
+        result = self.download(self.args.track, on_status)
+        result["timings"] = metrics.timings()
+        print(json.dumps(result))
 
-        print(json.dumps({"status": "success-delete", "message": "Success delete file {filename}", "data": "[]"}))
+    def get_info(self):
+        result = self.info(self.args.info)
+        result["timings"] = metrics.timings()
+        print(json.dumps(result))
+
+    def get_track(self):
+        result = self.get(self.args.get, self.args.rendition)
+        result["timings"] = metrics.timings()
+        print(json.dumps(result))
+
+    def delete_track(self):
+        print(json.dumps(self.delete(self.args.delete)))
+
+    def serve(self):
+        """Keeps one authenticated session alive and answers JSON-line commands"""
+        server = SpotifyServer(self)
+        if self.args.metrics_port:
+            serve_metrics(self.metrics_text, port=self.args.metrics_port)
+        if self.args.socket:
+            server.serve_unix(self.args.socket)
+        elif self.args.port:
+            server.serve_tcp(port=self.args.port)
+        else:
+            server.serve_stdio()
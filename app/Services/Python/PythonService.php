@@ -34,4 +34,31 @@ public function run(string $filename, array $parameters = [])
 
         return rtrim($process->output(), "\n");
     }
+
+    /**
+     * Send one JSON-line command to a Python worker started with `--serve --socket` or `--serve --port`.
+     *
+     * @param string $address The worker address, e.g. unix:///run/spotify.sock or tcp://127.0.0.1:8765.
+     * @param array $payload The command to send.
+     * @return string The JSON-line response of the worker.
+     * @throws \Exception If the worker cannot be reached or closes the connection.
+     */
+    public function send(string $address, array $payload)
+    {
+        $socket = @stream_socket_client($address, $errno, $errstr, 5);
+        if (!$socket) {
+            throw new Exception($errstr);
+        }
+
+        stream_set_timeout($socket, 600);
+        fwrite($socket, json_encode($payload) . "\n");
+        $output = fgets($socket);
+        fclose($socket);
+
+        if ($output === false) {
+            throw new Exception('Python worker closed the connection.');
+        }
+
+        return rtrim($output, "\n");
+    }
 }
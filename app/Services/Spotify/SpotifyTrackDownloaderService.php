@@ -8,6 +8,10 @@ class SpotifyTrackDownloaderService extends PythonService
 {
     public function getTrackInfo($url)
     {
+        if ($this->usesDaemon()) {
+            return $this->sendToDaemon(['command' => 'info', 'url' => $url]);
+        }
+
         $output = $this->run('D:\project-apps\python\spotify-downloader\main.py', [
             '-i ' . $url,
         ]);
@@ -17,6 +21,10 @@ public function getTrackInfo($url)
 
     public function processDownload(string $trackId)
     {
+        if ($this->usesDaemon()) {
+            return $this->sendToDaemon(['command' => 'download', 'url' => 'https://open.spotify.com/track/' . $trackId]);
+        }
+
         $output = $this->run('D:\project-apps\python\spotify-downloader\main.py', [
             '-tr https://open.spotify.com/track/' . $trackId,
         ]);
@@ -24,12 +32,62 @@ public function processDownload(string $trackId)
         return json_decode($output);
     }
 
+    /**
+     * Get a track stored by a --lazy worker, converting it on the first request.
+     *
+     * @param string $trackId
+     * @return object|null
+     */
+    public function getTrack(string $trackId)
+    {
+        if ($this->usesDaemon()) {
+            return $this->sendToDaemon(['command' => 'get', 'url' => 'https://open.spotify.com/track/' . $trackId]);
+        }
+
+        $output = $this->run('D:\project-apps\python\spotify-downloader\main.py', [
+            '-g https://open.spotify.com/track/' . $trackId,
+        ]);
+
+        return json_decode($output);
+    }
+
     public function deleteFile(string $filename)
     {
+        if ($this->usesDaemon()) {
+            return $this->sendToDaemon(['command' => 'delete', 'filename' => $filename]);
+        }
+
         $output = $this->run('D:\project-apps\python\spotify-downloader\main.py', [
             '-d ' . '"' . $filename . '"',
         ]);
 
         return json_decode($output);
     }
+
+    /**
+     * Whether a long-lived `main.py --serve` worker is configured.
+     *
+     * @return bool
+     */
+    public function usesDaemon()
+    {
+        return !empty(config('services.spotify_daemon.socket')) || !empty(config('services.spotify_daemon.port'));
+    }
+
+    /**
+     * Send a command to the long-lived worker and decode its response.
+     *
+     * @param array $payload
+     * @return object|null
+     */
+    protected function sendToDaemon(array $payload)
+    {
+        $address = config('services.spotify_daemon.socket')
+            ? 'unix://' . config('services.spotify_daemon.socket')
+            : 'tcp://' . config('services.spotify_daemon.host') . ':' . (int) config('services.spotify_daemon.port');
+
+        $output = $this->send($address, $payload);
+
+        return json_decode($output);
+    }
 }
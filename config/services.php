@@ -31,4 +31,10 @@
         'region' => env('AWS_DEFAULT_REGION', 'us-east-1'),
     ],
 
+    'spotify_daemon' => [
+        'socket' => env('SPOTIFY_DAEMON_SOCKET'),
+        'host' => env('SPOTIFY_DAEMON_HOST', '127.0.0.1'),
+        'port' => env('SPOTIFY_DAEMON_PORT'),
+    ],
+
 ];